@@ -0,0 +1,221 @@
+'''
+Shared, memoized price loader used by every week instead of building a new
+DataAccess per call.
+
+Each frame is cached per (key, symbols, date range) as DataAccess returned it,
+gaps included. A request for a subset of the symbols or a sub-range of the
+dates of a frame that is already loaded is served by slicing that frame, so
+repeated simulations in one process only go to disk once. Frames are evicted least recently used first once the
+cache grows past its memory budget.
+
+If a columnar price store (see price_store.py) is attached with
+use_price_store(), requests it covers are read from its memory mapped files
+instead of going through DataAccess.
+
+The ffill/bfill is applied to every frame handed out, after slicing, so a
+sub-range served from a bigger frame is filled exactly like a fresh load of
+that range, whatever was loaded before it.
+'''
+
+# QSTK Imports
+import QSTK.qstkutil.qsdateutil as du
+import QSTK.qstkutil.DataAccess as da
+
+# Third Party Imports
+import datetime as dt
+
+# LRU bookkeeping
+from collections import OrderedDict
+
+
+ALL_KEYS = ['open', 'high', 'low', 'close', 'volume', 'actual_close']
+
+
+# Function: fill_frame
+# Description:
+#   Takes a frame of prices
+#   Returns it forward filled, then back filled, then with 1.0 wherever still empty
+
+def fill_frame(frame):
+
+    frame = frame.fillna(method='ffill')
+    frame = frame.fillna(method='bfill')
+    frame = frame.fillna(1.0)
+
+    return frame
+
+
+class PriceCache:
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, source='Yahoo', cachestalltime=0):
+        self.max_bytes = max_bytes
+        self.source = source
+        self.cachestalltime = cachestalltime
+        self.data_obj = None
+
+        # entry id -> (key, unfilled frame), least recently used first
+        self.entries = OrderedDict()
+        self.next_entry_id = 0
+        self.num_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        # Optional price_store.PriceStore consulted before DataAccess
+        self.price_store = None
+
+    def data_access(self):
+        if self.data_obj is None:
+            self.data_obj = da.DataAccess(self.source, cachestalltime=self.cachestalltime)
+        return self.data_obj
+
+    # Returns the (unfilled) slice of a cached frame covering the request, or None
+    def lookup(self, timestamps, symbols, key):
+        first_date = timestamps[0]
+        last_date = timestamps[-1]
+
+        for entry_id in self.entries:
+            entry_key, frame = self.entries[entry_id]
+            if entry_key != key or len(frame.index) == 0:
+                continue
+            if frame.index[0] > first_date or frame.index[-1] < last_date:
+                continue
+            if not set(symbols).issubset(frame.columns):
+                continue
+
+            sub_frame = frame.loc[first_date:last_date, list(symbols)]
+            if len(sub_frame.index) != len(timestamps):
+                continue
+
+            # Mark as most recently used
+            self.entries[entry_id] = self.entries.pop(entry_id)
+            return sub_frame
+
+        return None
+
+    def store(self, key, frame):
+        # Drop entries the new frame fully covers
+        for entry_id in list(self.entries):
+            entry_key, cached_frame = self.entries[entry_id]
+            if entry_key == key and len(cached_frame.index) > 0 \
+                    and cached_frame.index[0] >= frame.index[0] \
+                    and cached_frame.index[-1] <= frame.index[-1] \
+                    and set(cached_frame.columns).issubset(frame.columns):
+                self.evict(entry_id)
+
+        self.entries[self.next_entry_id] = (key, frame)
+        self.next_entry_id += 1
+        self.num_bytes += frame.values.nbytes
+
+        while self.num_bytes > self.max_bytes and len(self.entries) > 1:
+            self.evict(next(iter(self.entries)))
+
+    def evict(self, entry_id):
+        entry_key, frame = self.entries.pop(entry_id)
+        self.num_bytes -= frame.values.nbytes
+
+    def get_data(self, timestamps, symbols, keys=ALL_KEYS):
+        symbol_data_dict = {}
+        missing_keys = []
+
+        for key in keys:
+            frame = self.lookup(timestamps, symbols, key)
+            if frame is None:
+                missing_keys.append(key)
+            else:
+                symbol_data_dict[key] = fill_frame(frame)
+
+        self.hits += len(keys) - len(missing_keys)
+        self.misses += len(missing_keys)
+
+        if missing_keys and self.price_store is not None and self.price_store.covers(timestamps, symbols, missing_keys):
+            # Memory mapped and already filled, nothing worth caching
+            for key in missing_keys:
+                symbol_data_dict[key] = self.price_store.get_frame(timestamps, symbols, key)
+            missing_keys = []
+
+        if missing_keys:
+            symbol_data = self.data_access().get_data(timestamps, list(symbols), missing_keys)
+            for key, frame in zip(missing_keys, symbol_data):
+                self.store(key, frame)
+                symbol_data_dict[key] = fill_frame(frame)
+
+        return symbol_data_dict
+
+    def clear(self):
+        self.entries.clear()
+        self.num_bytes = 0
+
+
+# Dictionary of frames keyed by key that only loads (and fills) a key the first
+# time it is read. Only the declared keys can be read, so a close-only caller
+# never pays for open/high/low/volume/actual_close
+
+class PricePanel(dict):
+
+    def __init__(self, cache, timestamps, symbols, keys):
+        dict.__init__(self)
+        self.cache = cache
+        self.timestamps = timestamps
+        self.symbols = list(symbols)
+        self.declared_keys = list(keys)
+
+    def __missing__(self, key):
+        if key not in self.declared_keys:
+            raise KeyError(key)
+        frame = self.cache.get_data(self.timestamps, self.symbols, [key])[key]
+        self[key] = frame
+        return frame
+
+    def copy(self):
+        panel = PricePanel(self.cache, self.timestamps, self.symbols, self.declared_keys)
+        panel.update(self)
+        return panel
+
+
+# Cache shared by everything running in this process
+shared_cache = PriceCache()
+
+
+# Function: get_data
+# Description:
+#   Takes timestamps, symbols and the keys the caller is going to use
+#   Returns a PricePanel over the shared cache; each key is loaded on first use
+
+def get_data(timestamps, symbols, keys=ALL_KEYS):
+    return PricePanel(shared_cache, timestamps, symbols, keys)
+
+
+# Function: load_data
+# Description:
+#   Takes startdate, enddate, symbols and keys. Assumes close of day (1600 hrs)
+#   Returns the timestamps and a PricePanel of filled frames from the shared cache
+
+def load_data(startdate, enddate, symbols, keys=ALL_KEYS):
+
+    time_of_day = dt.timedelta(hours=16)
+    timestamps = du.getNYSEdays(startdate, enddate, time_of_day)
+
+    return (timestamps, get_data(timestamps, symbols, keys))
+
+
+# Function: set_memory_budget
+# Description:
+#   Sets how many bytes of frames the shared cache keeps before evicting
+
+def set_memory_budget(max_bytes):
+
+    shared_cache.max_bytes = max_bytes
+    while shared_cache.num_bytes > max_bytes and len(shared_cache.entries) > 1:
+        shared_cache.evict(next(iter(shared_cache.entries)))
+
+
+# Function: use_price_store
+# Description:
+#   Takes the directory of a columnar price store written by price_store.write_store
+#   Makes the shared cache read whatever that store covers from it
+
+def use_price_store(store_dir):
+
+    import price_store
+    shared_cache.price_store = price_store.PriceStore(store_dir)
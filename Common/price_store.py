@@ -0,0 +1,145 @@
+'''
+On-disk columnar price store.
+
+write_store() converts DataAccess data into one contiguous float64 file per key
+(open, high, low, close, volume, actual_close), laid out symbol by symbol, plus
+a symbol index (symbols.txt) and a date index (dates.npy). The prices are stored
+already filled (ffill, bfill, 1.0).
+
+PriceStore memory maps those files. Reading a symbol subset over a date slice
+only touches the pages of that slice, so cold loads scale with what is asked
+for and not with the size of the universe. When the requested symbols are a
+contiguous run of the index the returned frames are views straight onto the
+mapped file; otherwise only the requested slice is copied.
+
+Usage: python price_store.py <store_dir> <symbol list> <startdate> <enddate>
+       dates as YYYY-MM-DD, e.g. python price_store.py sp500 sp5002012 2008-01-01 2009-12-31
+'''
+
+# QSTK Imports
+import QSTK.qstkutil.qsdateutil as du
+import QSTK.qstkutil.DataAccess as da
+
+# Third Party Imports
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+# Command Line inputs
+import sys
+import os
+
+import price_cache as pc
+
+
+# Function: write_store
+# Description:
+#   Takes a store directory, timestamps, symbols and keys
+#   Loads the symbols a chunk at a time and writes every key into its own
+#   (symbols x days) float64 file, plus the symbol and date indexes
+
+def write_store(store_dir, timestamps, symbols, keys=pc.ALL_KEYS, chunk_size=50):
+
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+
+    symbols = list(symbols)
+    num_days = len(timestamps)
+
+    with open(os.path.join(store_dir, 'symbols.txt'), 'w') as symbols_file:
+        symbols_file.write('\n'.join(symbols) + '\n')
+    np.save(os.path.join(store_dir, 'dates.npy'), pd.DatetimeIndex(timestamps).values)
+
+    key_files = {}
+    for key in keys:
+        key_files[key] = np.memmap(os.path.join(store_dir, key + '.f64'), dtype=np.float64,
+                                   mode='w+', shape=(len(symbols), num_days))
+
+    data_obj = da.DataAccess('Yahoo', cachestalltime=0)
+    for first in range(0, len(symbols), chunk_size):
+        chunk_symbols = symbols[first:first + chunk_size]
+        symbol_data = data_obj.get_data(timestamps, chunk_symbols, keys)
+        for key, frame in zip(keys, symbol_data):
+            key_files[key][first:first + len(chunk_symbols), :] = pc.fill_frame(frame).values.T
+
+    for key in keys:
+        key_files[key].flush()
+
+
+class PriceStore:
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+        with open(os.path.join(store_dir, 'symbols.txt')) as symbols_file:
+            self.symbols = [line.strip() for line in symbols_file if line.strip()]
+        self.symbol_positions = dict((symb, position) for position, symb in enumerate(self.symbols))
+        self.dates = pd.DatetimeIndex(np.load(os.path.join(store_dir, 'dates.npy')))
+
+        self.key_files = {}
+
+    def has_key(self, key):
+        return os.path.exists(os.path.join(self.store_dir, key + '.f64'))
+
+    def key_file(self, key):
+        if key not in self.key_files:
+            self.key_files[key] = np.memmap(os.path.join(self.store_dir, key + '.f64'), dtype=np.float64,
+                                            mode='r', shape=(len(self.symbols), len(self.dates)))
+        return self.key_files[key]
+
+    # Returns the [first, last) day positions of the timestamps, or None if the
+    # store does not hold exactly those days
+    def date_slice(self, timestamps):
+        first = self.dates.searchsorted(timestamps[0])
+        last = first + len(timestamps)
+        if last > len(self.dates) or not self.dates[first:last].equals(pd.DatetimeIndex(timestamps)):
+            return None
+        return (first, last)
+
+    def covers(self, timestamps, symbols, keys):
+        for key in keys:
+            if not self.has_key(key):
+                return False
+        for symb in symbols:
+            if symb not in self.symbol_positions:
+                return False
+        return self.date_slice(timestamps) is not None
+
+    def get_frame(self, timestamps, symbols, key):
+        first, last = self.date_slice(timestamps)
+        positions = [self.symbol_positions[symb] for symb in symbols]
+        key_file = self.key_file(key)
+
+        if positions == range(positions[0], positions[0] + len(positions)):
+            values = key_file[positions[0]:positions[-1] + 1, first:last]
+        else:
+            values = key_file[:, first:last][positions]
+
+        return pd.DataFrame(values.T, index=self.dates[first:last], columns=list(symbols), copy=False)
+
+    def get_data(self, timestamps, symbols, keys=pc.ALL_KEYS):
+        symbol_data_dict = {}
+        for key in keys:
+            symbol_data_dict[key] = self.get_frame(timestamps, symbols, key)
+        return symbol_data_dict
+
+
+def main():
+
+    store_dir = sys.argv[1]
+    symbol_list = sys.argv[2]
+    startdate = dt.datetime.strptime(sys.argv[3], '%Y-%m-%d')
+    enddate = dt.datetime.strptime(sys.argv[4], '%Y-%m-%d')
+
+    time_of_day = dt.timedelta(hours=16)
+    timestamps = du.getNYSEdays(startdate, enddate, time_of_day)
+
+    symbols = da.DataAccess('Yahoo').get_symbols_from_list(symbol_list)
+    if 'SPY' not in symbols:
+        symbols.append('SPY')
+
+    write_store(store_dir, timestamps, symbols)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+'''
+Rolling window metrics over a whole (days x series) panel at once -- symbols'
+close values or strategies' fund values, one column each.
+
+Windowed sums come from differences of running sums, so every window costs
+O(1) whatever its length and all the columns are done together. The returns
+are centered on their column average before summing, which keeps the running
+sums of squares small enough for the variance not to cancel out.
+
+The rolling peak used for drawdowns is a sliding window max computed with the
+van Herk / Gil-Werman block prefix / suffix maxima, also O(1) per window.
+
+Windows are trailing and include the day itself; days before the first full
+window are NaN. Standard deviations are population ones (like np.std), and
+Sharpe ratios are annualized with sqrt(252), as in the rest of the project.
+
+    metrics = rolling_metrics.rolling_report(symbol_data['close'], [20, 60, 252])
+    metrics[('sharpe', 60)]
+'''
+
+# Third Party Imports
+import numpy as np
+import pandas as pd
+
+
+# Function: as_panel
+# Description:
+#   Takes a DataFrame, a 2D array or a single series
+#   Returns it as a float (days x series) array
+
+def as_panel(data):
+
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        data = data.values
+    data = np.asarray(data, dtype=float)
+    return data.reshape(len(data), -1)
+
+
+# Function: like
+# Description:
+#   Takes the input the metric was computed from and the metric array
+#   Returns the metric with the input's index and columns if it was a DataFrame
+
+def like(data, values):
+
+    if isinstance(data, pd.DataFrame):
+        return pd.DataFrame(values, index=data.index, columns=data.columns)
+    if isinstance(data, pd.Series):
+        return pd.Series(values[:, 0], index=data.index, name=data.name)
+    return values
+
+
+# Function: window_sums
+# Description:
+#   Takes a (days x series) array and a window length
+#   Returns the sum over the trailing window ending on every day, NaN before the
+#   first full window
+
+def window_sums(panel, window):
+
+    running = np.zeros((panel.shape[0] + 1, panel.shape[1]))
+    np.cumsum(panel, axis=0, out=running[1:])
+
+    sums = np.empty(panel.shape)
+    sums[:window - 1] = np.NAN
+    if window <= panel.shape[0]:
+        sums[window - 1:] = running[window:] - running[:-window]
+    return sums
+
+
+# Function: rolling_mean_std
+# Description:
+#   Takes daily returns (days x series, no NaNs) and a window length
+#   Returns the rolling average and rolling standard deviation
+
+def rolling_mean_std(returns, window):
+
+    panel = as_panel(returns)
+    center = np.nanmean(panel, axis=0)
+    centered = panel - center
+
+    centered_mean = window_sums(centered, window) / window
+    variance = window_sums(centered * centered, window) / window - centered_mean * centered_mean
+
+    return (centered_mean + center, np.sqrt(np.maximum(variance, 0.0)))
+
+
+# Function: rolling_mean / rolling_std
+# Description:
+#   Takes daily returns and a window length
+#   Returns the rolling average / standard deviation, shaped like the returns
+
+def rolling_mean(returns, window):
+
+    return like(returns, rolling_mean_std(returns, window)[0])
+
+
+def rolling_std(returns, window):
+
+    return like(returns, rolling_mean_std(returns, window)[1])
+
+
+# Function: rolling_volatility
+# Description:
+#   Takes daily returns and a window length
+#   Returns the rolling standard deviation annualized with sqrt(252)
+
+def rolling_volatility(returns, window):
+
+    return like(returns, np.sqrt(252) * rolling_mean_std(returns, window)[1])
+
+
+# Function: rolling_sharpe
+# Description:
+#   Takes daily returns and a window length
+#   Returns the rolling Sharpe ratio, sqrt(252) * average / standard deviation
+
+def rolling_sharpe(returns, window):
+
+    mean, std = rolling_mean_std(returns, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return like(returns, np.sqrt(252) * mean / std)
+
+
+# Function: sliding_max
+# Description:
+#   Takes a (days x series) array and a window length
+#   Returns the max over the trailing window ending on every day, computed with
+#   the van Herk / Gil-Werman algorithm: the days are cut in blocks of the
+#   window length, and every window is the suffix of one block plus the prefix
+#   of the next, so its max is the max of one suffix max and one prefix max
+
+def sliding_max(panel, window):
+
+    num_days, num_series = panel.shape
+    num_blocks = -(-num_days // window)
+
+    padded = np.empty((num_blocks * window, num_series))
+    padded[:num_days] = panel
+    padded[num_days:] = -np.inf
+    blocks = padded.reshape(num_blocks, window, num_series)
+
+    prefix_max = np.maximum.accumulate(blocks, axis=1).reshape(-1, num_series)
+    suffix_max = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(-1, num_series)
+
+    window_max = np.empty(panel.shape)
+    window_max[:window - 1] = np.NAN
+    if window <= num_days:
+        window_max[window - 1:] = np.maximum(suffix_max[:num_days - window + 1], prefix_max[window - 1:num_days])
+    return window_max
+
+
+# Function: rolling_drawdown
+# Description:
+#   Takes values (days x series) and a window length
+#   Returns how far every day's value is below the highest value of the trailing
+#   window (0 at a new high, negative below it)
+
+def rolling_drawdown(values, window):
+
+    panel = as_panel(values)
+    return like(values, panel / sliding_max(panel, window) - 1)
+
+
+# Function: daily_returns
+# Description:
+#   Takes values (days x series)
+#   Returns the daily returns, NaN on the first day
+
+def daily_returns(values):
+
+    panel = as_panel(values)
+    returns = np.empty(panel.shape)
+    returns[0] = np.NAN
+    returns[1:] = panel[1:] / panel[:-1] - 1
+    return like(values, returns)
+
+
+# Function: rolling_report
+# Description:
+#   Takes values (days x series), e.g. close values or fund values, and the
+#   window lengths
+#   Returns a dictionary of (metric, window) -> rolling metric for the metrics
+#   'mean', 'volatility', 'sharpe' and 'drawdown', all aligned on the values'
+#   days. The returns are only computed once for all the windows
+
+def rolling_report(values, windows=[20, 60, 252]):
+
+    panel = as_panel(values)
+    returns = as_panel(daily_returns(panel))[1:]
+
+    report = {}
+    for window in windows:
+        mean = np.empty(panel.shape)
+        std = np.empty(panel.shape)
+        mean[0] = np.NAN
+        std[0] = np.NAN
+        mean[1:], std[1:] = rolling_mean_std(returns, window)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            report[('mean', window)] = like(values, mean)
+            report[('volatility', window)] = like(values, np.sqrt(252) * std)
+            report[('sharpe', window)] = like(values, np.sqrt(252) * mean / std)
+        report[('drawdown', window)] = like(values, panel / sliding_max(panel, window) - 1)
+
+    return report
@@ -0,0 +1,112 @@
+'''
+Fund values files shared by marketsim (writer) and analyze (reader).
+
+Two formats, picked by the file extension:
+
+  .csv  the original one row per day: year, month, day, value[, value ...]
+  .npy  a structured array with an int32 'date' field (yyyymmdd) and a
+        'values' field of one float64 per series, dumped with a single np.save
+        and read back memory mapped, so a file of thousands of series loads
+        without parsing anything. The series names go in <file>.names, one per
+        line, like the symbol index of the price store
+
+Both are read back as (dates, days x series values matrix, series names);
+files without names call their series value, value_1, value_2, ...
+'''
+
+# Third Party Imports
+import datetime as dt
+import numpy as np
+
+# CSV parser
+import csv
+import os
+
+
+# Function: dates_to_ints
+# Description:
+#   Takes a list of dates
+#   Returns them as an int32 array of yyyymmdd
+
+def dates_to_ints(dates):
+
+    return np.array([d.year * 10000 + d.month * 100 + d.day for d in dates], dtype=np.int32)
+
+
+# Function: ints_to_dates
+# Description:
+#   Takes an array of yyyymmdd ints
+#   Returns the dates as datetimes at 1600 hrs, like the rest of the project
+
+def ints_to_dates(date_ints):
+
+    return [dt.datetime(d // 10000, d // 100 % 100, d % 100, 16) for d in np.asarray(date_ints).tolist()]
+
+
+def default_names(num_series):
+
+    return ['value'] + ['value_%d' % idx for idx in range(1, num_series)]
+
+
+def is_binary(values_file):
+
+    return values_file.lower().endswith('.npy')
+
+
+# Function: write_values
+# Description:
+#   Takes the values file, the dates, the (days x series) values (or one series)
+#   and optionally the series names
+#   Writes the binary format for .npy files and CSV rows otherwise
+
+def write_values(values_file, dates, values, names=None):
+
+    values = np.asarray(values, dtype=np.float64).reshape(len(dates), -1)
+    if names is None:
+        names = default_names(values.shape[1])
+
+    if is_binary(values_file):
+        records = np.empty(len(dates), dtype=[('date', '<i4'), ('values', '<f8', (values.shape[1],))])
+        records['date'] = dates_to_ints(dates)
+        records['values'] = values
+        np.save(values_file, records)
+        with open(values_file + '.names', 'w') as names_file:
+            names_file.write('\n'.join(names) + '\n')
+    else:
+        writer = csv.writer(open(values_file, 'wb'), delimiter=',')
+        for idx in range(len(dates)):
+            d = dates[idx]
+            writer.writerow([d.year, d.month, d.day] + values[idx].tolist())
+
+
+# Function: load_records
+# Description:
+#   Takes a binary values file
+#   Returns its structured array, memory mapped; load_records(values_file)['values']
+#   is a zero copy (days x series) view
+
+def load_records(values_file):
+
+    return np.load(values_file, mmap_mode='r')
+
+
+# Function: read_values
+# Description:
+#   Takes the values file
+#   Returns the dates, the (days x series) values matrix and the series names
+
+def read_values(values_file):
+
+    if is_binary(values_file):
+        records = load_records(values_file)
+        values = records['values'].reshape(len(records), -1)
+        names = default_names(values.shape[1])
+        if os.path.exists(values_file + '.names'):
+            with open(values_file + '.names') as names_file:
+                names = [line.strip() for line in names_file if line.strip()]
+        return (ints_to_dates(records['date']), values, names)
+
+    rows = [row for row in csv.reader(open(values_file, 'rU'), delimiter=',')]
+    dates = [dt.datetime(int(row[0]), int(row[1]), int(row[2]), 16) for row in rows]
+    values = np.array([[float(value) for value in row[3:]] for row in rows]).reshape(len(rows), -1)
+    return (dates, values, default_names(values.shape[1]))
@@ -14,28 +14,27 @@ import sys
 # NumPy import
 import numpy as np
 
+# Shared price cache
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+import price_cache as pc
+
 # Function: initialize
 # Description: 
 #   Generic initialize function. Assumes time delta for close of day (1600 hrs)
-#   Gets symbol data based on startdate, enddate, and symbols
+#   Gets symbol data based on startdate, enddate, and symbols from the shared price cache
+#   Only the given keys are loaded (just close by default), each on first use
 #   Returns a dictionary of the symbol data, keyed using symbols or key value 
 
-def initialize(startdate, enddate, symbols):
+def initialize(startdate, enddate, symbols, keys=['close']):
 
-    keys = ['open', 'high', 'low', 'close', 'volume', 'actual_close']
     num_symbols = len(symbols)
 
     time_of_day = dt.timedelta(hours=16)
     timestamps = du.getNYSEdays(startdate, enddate, time_of_day)
     
-    symbol_data_obj = da.DataAccess('Yahoo', cachestalltime=0)
-    symbol_data = symbol_data_obj.get_data(timestamps, symbols, keys)
-    symbol_data_dict = dict(zip(keys, symbol_data))
-
-    for key in keys:
-        symbol_data_dict[key] = symbol_data_dict[key].fillna(method='ffill')
-        symbol_data_dict[key] = symbol_data_dict[key].fillna(method='bfill')
-        symbol_data_dict[key] = symbol_data_dict[key].fillna(1.0)
+    # Filled (ffill, bfill, 1.0) and memoized by the shared price cache
+    symbol_data_dict = pc.get_data(timestamps, symbols, keys)
 
     return symbol_data_dict
 
@@ -146,26 +145,56 @@ def sharpe_ratio_calc(mean_returns, stddev_returns,  frequency='daily'):
 
 # Function: simulate
 # Description: 
-#   Takes in startdate, enddate, symbols, allocations
+#   Takes in startdate, enddate, symbols, allocations and optionally a rebalancing
+#   frequency ('daily', 'weekly', 'monthly' or a list of dates)
+#   Values the fund through the batch evaluator (compounded returns, total = last
+#   value / first value) whether it is bought and held or rebalanced, so every
+#   rebalancing frequency, including none, is on the same accounting as
+#   batch_simulate() and optimizer(); when it rebalances the turnover is printed too
+#   legacy=True runs the original returns_calc path instead, which adds up the
+#   daily returns and reports the sum of the normalized fund values as the total;
+#   it only does buy and hold
 #   Returns mean daily returns, stddev of daily returns (volatility), sharpe ratio, total fund cumulative returns
 
 
-def simulate(startdate, enddate, symbols, allocations):
+def simulate(startdate, enddate, symbols, allocations, rebalance=None, legacy=False):
     
     symbol_data_dict = initialize(startdate, enddate, symbols)
+    rebalance_positions = rebalance_positions_calc(symbol_data_dict['close'].index, rebalance)
 
-    total_fund_cumulative_returns, fund_daily_returns = returns_calc(startdate, enddate, symbols, allocations, "daily", symbol_data_dict)
+    if legacy:
+        if len(rebalance_positions) > 1:
+            raise ValueError('The legacy returns_calc path does not rebalance')
 
-    mean_returns = mean_returns_calc(fund_daily_returns)
-    stddev_returns = stddev_returns_calc(fund_daily_returns)
-    sharpe_ratio = sharpe_ratio_calc(mean_returns, stddev_returns)
+        total_fund_cumulative_returns, fund_daily_returns = returns_calc(startdate, enddate, symbols, allocations, "daily", symbol_data_dict)
 
-    print 'Mean: ', mean_returns
-    print 'Volatility: ', stddev_returns
-    print 'Sharpe Ratio:', sharpe_ratio
-    print 'Total Cumulative Returns: ', total_fund_cumulative_returns
+        mean_returns = mean_returns_calc(fund_daily_returns)
+        stddev_returns = stddev_returns_calc(fund_daily_returns)
+        sharpe_ratio = sharpe_ratio_calc(mean_returns, stddev_returns)
 
-    return (mean_returns, stddev_returns, sharpe_ratio, total_fund_cumulative_returns)
+        print 'Mean: ', mean_returns
+        print 'Volatility: ', stddev_returns
+        print 'Sharpe Ratio:', sharpe_ratio
+        print 'Total Cumulative Returns: ', total_fund_cumulative_returns
+
+        return (mean_returns, stddev_returns, sharpe_ratio, total_fund_cumulative_returns)
+
+    close_values = symbol_data_dict['close'].values
+    normalized_close_values = close_values / close_values[0, :]
+    allocations = np.atleast_2d(np.asarray(allocations, dtype=float))
+
+    mean, stddev, sharpe, cum_ret = batch_metrics_calc(normalized_close_values, allocations, 'daily',
+                                                       rebalance_positions)
+
+    print 'Mean: ', mean[0]
+    print 'Volatility: ', stddev[0]
+    print 'Sharpe Ratio:', sharpe[0]
+    print 'Total Cumulative Returns: ', cum_ret[0]
+    if len(rebalance_positions) > 1:
+        print 'Rebalances: ', len(rebalance_positions) - 1
+        print 'Turnover: ', turnover_calc(normalized_close_values, allocations, rebalance_positions)[0]
+
+    return (mean[0], stddev[0], sharpe[0], cum_ret[0])
 
     #print daily_ret_values
     
@@ -214,6 +243,156 @@ def simulate(startdate, enddate, symbols, allocations):
     
 
 
+# Function: rebalance_positions_calc
+# Description:
+#   Takes the trading days and a rebalancing frequency: None (buy and hold),
+#   'daily', 'weekly', 'monthly' or a list of dates
+#   'weekly' and 'monthly' rebalance on the first trading day of every week or
+#   month, a date that is not a trading day on the next trading day
+#   Returns the sorted day positions at whose close the weights are reset to
+#   target, always starting with 0 (the initial allocation)
+
+def rebalance_positions_calc(dates, rebalance=None):
+
+    dates = pd.DatetimeIndex(dates)
+    num_trading_days = len(dates)
+
+    if rebalance is None or (isinstance(rebalance, str) and rebalance.lower() == 'none'):
+        positions = np.zeros(1, dtype=int)
+    elif isinstance(rebalance, str) and rebalance.lower() == 'daily':
+        positions = np.arange(num_trading_days)
+    elif isinstance(rebalance, str) and rebalance.lower() in ('weekly', 'monthly'):
+        if rebalance.lower() == 'weekly':
+            periods = (dates.normalize() - pd.to_timedelta(dates.weekday, unit='D')).asi8
+        else:
+            periods = dates.year * 12 + dates.month
+        periods = np.asarray(periods)
+        positions = np.concatenate(([0], np.nonzero(periods[1:] != periods[:-1])[0] + 1))
+    else:
+        positions = dates.searchsorted(pd.DatetimeIndex(list(rebalance)))
+        positions = np.concatenate(([0], positions[positions < num_trading_days]))
+
+    return np.unique(positions)
+
+
+# Function: rebalanced_values_calc
+# Description:
+#   Takes the normalized close values (days x symbols), an allocation matrix
+#   (N_allocations x N_symbols) and the rebalance day positions
+#   Between two rebalances the holdings drift with the prices; at each rebalance
+#   the fund is reset to the target weights. Every day's value is the fund value
+#   at its segment's start times the segment's growth so far, so the whole
+#   matrix is one product over the days plus one running product over the
+#   segments, with no loop over the days
+#   Returns the fund value of every allocation per day (days x N_allocations);
+#   with only position 0 this is the same as buy and hold
+
+def rebalanced_values_calc(normalized_close_values, allocations, rebalance_positions):
+
+    num_trading_days = len(normalized_close_values)
+    allocations = np.atleast_2d(allocations)
+    allocation_sums = allocations.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weights = allocations / allocation_sums[:, np.newaxis]
+
+    segment_ids = np.searchsorted(rebalance_positions, np.arange(num_trading_days), side='right') - 1
+    segment_starts = rebalance_positions[segment_ids]
+
+    # Growth since the segment start, and growth of every whole segment
+    segment_growth = np.dot(normalized_close_values / normalized_close_values[segment_starts], weights.T)
+    segment_end_growth = np.dot(normalized_close_values[rebalance_positions[1:]] /
+                                normalized_close_values[rebalance_positions[:-1]], weights.T)
+
+    start_values = np.ones((len(rebalance_positions), len(allocations)))
+    start_values[1:] = np.cumprod(segment_end_growth, axis=0)
+
+    return allocation_sums * start_values[segment_ids] * segment_growth
+
+
+# Function: turnover_calc
+# Description:
+#   Takes the normalized close values, an allocation matrix and the rebalance
+#   day positions
+#   Returns the turnover of every allocation: summed over the rebalances, half
+#   the sum of the absolute differences between the drifted and the target
+#   weights (the fraction of the fund bought, which equals the fraction sold)
+#   The price ratios of every segment are gathered at once, as in
+#   rebalanced_values_calc, and the (segments x allocations x symbols) drifts are
+#   reduced chunk_size allocations at a time so memory stays bounded
+
+def turnover_calc(normalized_close_values, allocations, rebalance_positions, chunk_size=1000):
+
+    allocations = np.atleast_2d(allocations)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weights = allocations / allocations.sum(axis=1)[:, np.newaxis]
+
+    # (segments x symbols) price ratios and (segments x allocations) fund growth
+    price_ratios = (normalized_close_values[rebalance_positions[1:]] /
+                    normalized_close_values[rebalance_positions[:-1]])
+    fund_growth = np.dot(price_ratios, weights.T)
+
+    turnover = np.empty(len(allocations))
+    for row in range(0, len(allocations), chunk_size):
+        drift = np.abs(1 - price_ratios[:, np.newaxis, :] / fund_growth[:, row:row + chunk_size, np.newaxis])
+        turnover[row:row + chunk_size] = 0.5 * np.einsum('aj,saj->a', weights[row:row + chunk_size], drift)
+
+    return turnover
+
+
+# Function: batch_metrics_calc
+# Description:
+#   Takes the normalized close values (days x symbols), an allocation matrix and
+#   optionally the rebalance day positions (see rebalance_positions_calc)
+#   Returns arrays of mean daily returns, stddev of daily returns, sharpe ratio
+#   and total cumulative returns, one entry per allocation row
+#   The first day counts as a zero return, same as returnize0 in simulate()
+
+def batch_metrics_calc(normalized_close_values, allocations, frequency='daily', rebalance_positions=None):
+
+    if rebalance_positions is None or len(rebalance_positions) <= 1:
+        fund_cumulative_returns = np.dot(normalized_close_values, allocations.T)
+    else:
+        fund_cumulative_returns = rebalanced_values_calc(normalized_close_values, allocations, rebalance_positions)
+    num_trading_days = len(fund_cumulative_returns)
+
+    # Daily returns without the leading zero row; sums below divide by all days
+    fund_daily_returns = fund_cumulative_returns[1:, :] / fund_cumulative_returns[:-1, :]
+    fund_daily_returns -= 1
+
+    mean_returns = fund_daily_returns.sum(axis=0) / num_trading_days
+    mean_square_returns = np.einsum('ij,ij->j', fund_daily_returns, fund_daily_returns) / num_trading_days
+    stddev_returns = np.sqrt(np.maximum(mean_square_returns - mean_returns * mean_returns, 0.0))
+    sharpe_ratio = sharpe_ratio_calc(mean_returns, stddev_returns, frequency)
+    total_fund_cumulative_returns = fund_cumulative_returns[-1, :] / fund_cumulative_returns[0, :]
+
+    return (mean_returns, stddev_returns, sharpe_ratio, total_fund_cumulative_returns)
+
+
+# Function: batch_simulate
+# Description:
+#   Takes in startdate, enddate, symbols, an (N_allocations x N_symbols) matrix
+#   and optionally a rebalancing frequency (see rebalance_positions_calc)
+#   Loads the close values once and scores every allocation in a single pass
+#   instead of calling simulate() (and reloading the data) once per allocation
+#   Returns arrays of mean daily returns, stddev of daily returns (volatility),
+#   sharpe ratio and total fund cumulative returns, one entry per allocation
+
+def batch_simulate(startdate, enddate, symbols, allocations, symbol_data_dict=None, rebalance=None):
+
+    if symbol_data_dict is None:
+        symbol_data_dict = initialize(startdate, enddate, symbols)
+
+    allocations = np.atleast_2d(np.asarray(allocations, dtype=float))
+
+    close_values = symbol_data_dict['close'].values
+    normalized_close_values = close_values / close_values[0, :]
+
+    rebalance_positions = rebalance_positions_calc(symbol_data_dict['close'].index, rebalance)
+
+    return batch_metrics_calc(normalized_close_values, allocations, 'daily', rebalance_positions)
+
+
+
 # Function: get_digits
 # Description: 
 #   Takes in a number
@@ -234,52 +413,358 @@ def get_digits(number):
 
 
 
+# Function: allocation_tail
+# Description:
+#   Takes the number of remaining units and the number of tail symbols (1 to 3)
+#   Returns an int array with every way of splitting those units across the tail symbols
+
+def allocation_tail(remaining, tail_size):
+
+    if tail_size == 1:
+        return np.array([[remaining]])
+
+    if tail_size == 2:
+        first = np.arange(remaining + 1)
+        return np.column_stack((first, remaining - first))
+
+    first, second = np.indices((remaining + 1, remaining + 1)).reshape(2, -1)
+    legal = (first + second) <= remaining
+    first = first[legal]
+    second = second[legal]
+    return np.column_stack((first, second, remaining - first - second))
+
+
+# Function: allocation_prefixes
+# Description:
+#   Takes the total number of units and a prefix length
+#   Lazily yields every tuple of that length whose units sum to at most the total
+
+def allocation_prefixes(units, prefix_size):
+
+    if prefix_size == 0:
+        yield ()
+        return
+
+    for first in range(units + 1):
+        for rest in allocation_prefixes(units - first, prefix_size - 1):
+            yield (first,) + rest
+
+
+# Function: allocation_grid
+# Description:
+#   Takes the number of symbols, the allocation step (0.1, 0.01, 0.005 ...) and a chunk size
+#   Enumerates every allocation on the step grid that sums to 1.0 directly, instead
+#   of scanning all integers for digit sums. The last (up to) three symbols are
+#   filled in vectorized per prefix, so the Python loop only runs over the prefixes
+#   Yields (chunk_size x num_symbols) arrays so memory stays bounded
+
+def allocation_grid(num_symbols, step=0.1, chunk_size=20000):
+
+    units = int(round(1.0 / step))
+    tail_size = min(num_symbols, 3)
+    prefix_size = num_symbols - tail_size
+    tails = [allocation_tail(remaining, tail_size) for remaining in range(units + 1)]
+
+    pending = []
+    pending_rows = 0
+
+    for prefix in allocation_prefixes(units, prefix_size):
+        tail = tails[units - sum(prefix)]
+        block = np.empty((len(tail), num_symbols))
+        block[:, :prefix_size] = prefix
+        block[:, prefix_size:] = tail
+        pending.append(block)
+        pending_rows += len(block)
+
+        if pending_rows >= chunk_size:
+            unit_allocations = np.concatenate(pending)
+            for row in range(0, pending_rows - chunk_size + 1, chunk_size):
+                yield unit_allocations[row:row + chunk_size] / float(units)
+            leftover = pending_rows % chunk_size
+            pending = [unit_allocations[pending_rows - leftover:]] if leftover else []
+            pending_rows = leftover
+
+    if pending_rows > 0:
+        yield np.concatenate(pending) / float(units)
+
+
+# Function: returns_moments_calc
+# Description:
+#   Takes the close values (days x symbols)
+#   Returns the mean daily return vector and the covariance matrix of the daily
+#   returns, computed once so the continuous optimizer never touches the days again
+
+def returns_moments_calc(close_values):
+
+    daily_ret_values = (close_values[1:, :] / close_values[:-1, :]) - 1
+
+    mean_returns = np.average(daily_ret_values, axis=0)
+    covariance = np.cov(daily_ret_values, rowvar=False, bias=True)
+
+    return (mean_returns, np.atleast_2d(covariance))
+
+
+# Function: project_to_simplex
+# Description:
+#   Takes a vector of weights
+#   Returns the closest long-only, fully invested allocation (non negative, sums to 1)
+
+def project_to_simplex(weights):
+
+    sorted_weights = np.sort(weights)[::-1]
+    cumulative_weights = np.cumsum(sorted_weights) - 1.0
+    positions = np.arange(1, len(weights) + 1)
+    last_positive = np.nonzero(sorted_weights - cumulative_weights / positions > 0)[0][-1]
+    shift = cumulative_weights[last_positive] / (last_positive + 1.0)
+
+    return np.maximum(weights - shift, 0.0)
+
+
+# Function: portfolio_sharpe_calc
+# Description:
+#   Takes an allocation, the mean daily return vector and the covariance matrix
+#   Returns the (daily) sharpe ratio of the allocation and its gradient
+
+def portfolio_sharpe_calc(weights, mean_returns, covariance):
+
+    covariance_weights = np.dot(covariance, weights)
+    mean_return = np.dot(weights, mean_returns)
+    stddev_return = np.sqrt(np.dot(weights, covariance_weights))
+
+    sharpe_ratio = mean_return / stddev_return
+    gradient = (mean_returns / stddev_return) - (mean_return / stddev_return ** 3) * covariance_weights
+
+    return (sharpe_ratio, gradient)
+
+
+# Function: max_sharpe_weights
+# Description:
+#   Takes the mean daily return vector, the covariance matrix and optionally a
+#   starting allocation
+#   Runs projected gradient ascent on the sharpe ratio over long-only, fully
+#   invested allocations, halving the step when it overshoots. Every iteration
+#   costs O(n^2) regardless of the number of days
+#   Returns the best allocation found
+
+def max_sharpe_weights(mean_returns, covariance, initial_weights=None, max_iterations=1000, tolerance=1e-10):
+
+    num_symbols = len(mean_returns)
+
+    if initial_weights is None:
+        weights = np.ones(num_symbols) / num_symbols
+    else:
+        weights = project_to_simplex(np.asarray(initial_weights, dtype=float))
+
+    sharpe_ratio, gradient = portfolio_sharpe_calc(weights, mean_returns, covariance)
+    step = 1.0 / max(np.abs(gradient).max(), 1e-12)
+
+    for iteration in range(max_iterations):
+        new_weights = project_to_simplex(weights + step * gradient)
+        new_sharpe_ratio, new_gradient = portfolio_sharpe_calc(new_weights, mean_returns, covariance)
+
+        if not new_sharpe_ratio >= sharpe_ratio:
+            step = step / 2
+            if step < 1e-16:
+                break
+            continue
+
+        moved = np.abs(new_weights - weights).sum()
+        weights, sharpe_ratio, gradient = new_weights, new_sharpe_ratio, new_gradient
+        step = step * 2
+
+        if moved < tolerance:
+            break
+
+    return weights
+
+
+# Function: sharpe_optimizer
+# Description:
+#   Takes the startdate, enddate and symbols
+#   Precomputes the mean return vector and covariance matrix once, then solves the
+#   long-only, fully invested max sharpe problem continuously instead of on a grid,
+#   so it scales to hundreds of symbols
+#   That problem is the sharpe ratio of a portfolio held at constant weights, so
+#   the solution can differ slightly from the best buy and hold (or rebalanced)
+#   allocation of the grid; the sharpe ratio returned is the solution's own on
+#   the optimizer's metric, from one batch_metrics_calc call
+#   Returns (sharpe ratio, allocation), comparable with what optimizer() reports
+#   for the grid
+
+def sharpe_optimizer(startdate, enddate, symbols, symbol_data_dict=None, rebalance_positions=None):
+
+    if symbol_data_dict is None:
+        symbol_data_dict = initialize(startdate, enddate, symbols)
+
+    close_values = symbol_data_dict['close'].values
+    mean_returns, covariance = returns_moments_calc(close_values)
+
+    best_opt = max_sharpe_weights(mean_returns, covariance)
+
+    normalized_close_values = close_values / close_values[0, :]
+    mean, stddev, sharpe, cum_ret = batch_metrics_calc(normalized_close_values, np.atleast_2d(best_opt), 'daily',
+                                                       rebalance_positions)
+
+    return (sharpe[0], best_opt)
+
+
 # Function: Optimizer
 # Description: 
-#   Takes the startdate, enddate, symbols 
-#   Runs simulate for all legal allocations in 10% increments
+#   Takes the startdate, enddate, symbols and the allocation step (10% by default)
+#   Loads the data once, then scores every legal allocation on the step grid in
+#   chunks through the batch evaluator
 #   Keeps track of the best sharpe ratio and corresponding allocation
-#   TODO: What if the increment is less than 10%? 
+#   method='continuous' skips the grid and uses sharpe_optimizer instead
+#   An already loaded symbol_data_dict can be passed in to skip the data load
+#   rebalance scores the allocations rebalanced daily, weekly, monthly or on a
+#   list of dates instead of bought and held (see rebalance_positions_calc)
+#   Returns (best sharpe ratio, best allocation)
 
-def optimizer(startdate, enddate, symbols):
+def optimizer(startdate, enddate, symbols, step=0.1, chunk_size=20000, method='grid',
+              symbol_data_dict=None, verbose=True, rebalance=None):
 
     best_sharpe_ratio = 0
     best_opt = []
-    delta = 0.1
-    delta_array = [0.0 + i*delta for i in range(0, 11)]
 
-    allocation = np.zeros((len(symbols)))
-    possible_allocations = []
+    if symbol_data_dict is None:
+        symbol_data_dict = initialize(startdate, enddate, symbols)
 
-    num_symbols = len(symbols)
-    lower = np.power(10, num_symbols - 1 )
-    higher = np.power(10, len(symbols) ) - 1
+    close_values = symbol_data_dict['close'].values
+    normalized_close_values = close_values / close_values[0, :]
+    rebalance_positions = rebalance_positions_calc(symbol_data_dict['close'].index, rebalance)
+
+    if method == 'continuous':
+        best_sharpe_ratio, best_opt = sharpe_optimizer(startdate, enddate, symbols, symbol_data_dict,
+                                                       rebalance_positions)
+    else:
+        for allocations in allocation_grid(len(symbols), step, chunk_size):
+            mean, stddev, sharpe, cum_ret = batch_metrics_calc(normalized_close_values, allocations, 'daily',
+                                                               rebalance_positions)
+            sharpe = np.where(np.isnan(sharpe), -np.inf, sharpe)
+            best_index = np.argmax(sharpe)
+            if sharpe[best_index] > best_sharpe_ratio:
+                best_sharpe_ratio = sharpe[best_index]
+                best_opt = allocations[best_index].copy()
+
+
+    if verbose:
+        print 'Best Sharpe Ratio: ', best_sharpe_ratio
+        print 'Best allocation: ', best_opt
+        if len(rebalance_positions) > 1 and len(best_opt) > 0:
+            print 'Turnover: ', turnover_calc(normalized_close_values, best_opt, rebalance_positions)[0]
+
+    return (best_sharpe_ratio, best_opt)
+    
+    
 
+# Function: window_moments_calc
+# Description:
+#   Takes the running sum and running sum of outer products of the (centered)
+#   daily returns in a window, the window length and the center that was
+#   subtracted from the returns
+#   Returns the mean return vector and the covariance matrix of the window, same
+#   as returns_moments_calc on it
 
-    for i in range(lower, higher):
-        arr = get_digits(i)
-        div_arr = arr
-        if np.sum(arr) == 10:
-            div_arr[:] = [x / 10.0 for x in arr]
-            possible_allocations.append(div_arr)
+def window_moments_calc(sums, squares, window, center):
 
-    for index in range(len(symbols)):
-        ones_alloc = np.zeros((len(symbols)))
-        ones_alloc[index] = 1.0
-        possible_allocations.append(ones_alloc)
+    centered_mean = sums / window
+    covariance = squares / window - np.outer(centered_mean, centered_mean)
 
+    return (centered_mean + center, covariance)
 
-    for alloc in range(len(possible_allocations)):
-        mean, stddev, sharpe, cum_ret = simulate(startdate, enddate, symbols, possible_allocations[alloc])
-        if sharpe > best_sharpe_ratio:
-            best_sharpe_ratio = sharpe
-            best_opt = possible_allocations[alloc]
 
+# Function: segment_values_calc
+# Description:
+#   Takes the close values (days x symbols) of a holding period, an allocation
+#   and optionally the positions in the period where it is rebalanced to target
+#   Returns the value of 1.0 invested at the first close and left to drift with
+#   the prices between rebalances on every day of the period
+
+def segment_values_calc(close_values, weights, rebalance_positions=None):
+
+    normalized_close_values = close_values / close_values[0, :]
+    if rebalance_positions is None or len(rebalance_positions) <= 1:
+        return np.dot(normalized_close_values, weights)
+
+    return rebalanced_values_calc(normalized_close_values, np.atleast_2d(weights), rebalance_positions)[:, 0]
+
+
+# Function: walk_forward
+# Description:
+#   Takes the startdate, enddate, symbols, the length of the trailing window
+#   the allocation is fitted on and the number of days between re-optimizations
+#   Every rebalance_days days, fits the max sharpe allocation on the window_days
+#   daily returns up to that day's close (warm started from the previous one),
+#   then holds it out of sample, drifting with the prices, until the next one;
+#   rebalance also resets it to target in between (see rebalance_positions_calc)
+#   The window's sum and sum of outer products of the returns are updated with
+#   only the days entering and leaving it, instead of recomputing the mean and
+#   covariance over the whole window every time
+#   Returns the out of sample fund values (1.0 at the first rebalance) and the
+#   allocations, indexed by the days they were chosen on
+
+def walk_forward(startdate, enddate, symbols, window_days=252, rebalance_days=21, symbol_data_dict=None,
+                 rebalance=None):
+
+    if symbol_data_dict is None:
+        symbol_data_dict = initialize(startdate, enddate, symbols)
+
+    close_values = symbol_data_dict['close'].values
+    dates = symbol_data_dict['close'].index
+    num_days = len(close_values)
+    rebalance_positions = rebalance_positions_calc(dates, rebalance)
+
+    if num_days <= window_days + 1:
+        raise ValueError('Need more than %d days of data for a %d day window' % (window_days + 1, window_days))
+    if rebalance_days < 1:
+        raise ValueError('Need at least 1 day between re-optimizations, not %d' % rebalance_days)
+
+    # Returns row r is the return from close r to close r + 1. Centering them on
+    # the first window's average keeps the running sums well conditioned
+    daily_ret_values = (close_values[1:, :] / close_values[:-1, :]) - 1
+    center = np.average(daily_ret_values[:window_days], axis=0)
+    centered_returns = daily_ret_values - center
+
+    window_returns = centered_returns[:window_days]
+    sums = window_returns.sum(axis=0)
+    squares = np.dot(window_returns.T, window_returns)
+
+    fund_values = np.empty(num_days - window_days)
+    fund_values[0] = 1.0
+    rebalance_dates = []
+    allocations = []
+    weights = None
+
+    # The window ending at close t covers the returns rows t - window_days .. t - 1
+    t = window_days
+    while t < num_days - 1:
+        if t > window_days:
+            if rebalance_days >= window_days:
+                window_returns = centered_returns[t - window_days:t]
+                sums = window_returns.sum(axis=0)
+                squares = np.dot(window_returns.T, window_returns)
+            else:
+                entering = centered_returns[t - rebalance_days:t]
+                leaving = centered_returns[t - window_days - rebalance_days:t - window_days]
+                sums += entering.sum(axis=0) - leaving.sum(axis=0)
+                squares += np.dot(entering.T, entering) - np.dot(leaving.T, leaving)
+
+        mean_returns, covariance = window_moments_calc(sums, squares, window_days, center)
+        weights = max_sharpe_weights(mean_returns, covariance, initial_weights=weights)
+        rebalance_dates.append(dates[t])
+        allocations.append(weights)
+
+        last = min(t + rebalance_days, num_days - 1)
+        in_segment = rebalance_positions[(rebalance_positions > t) & (rebalance_positions <= last)] - t
+        segment_values = segment_values_calc(close_values[t:last + 1], weights, np.concatenate(([0], in_segment)))
+        start_value = fund_values[t - window_days]
+        fund_values[t - window_days:last - window_days + 1] = start_value * segment_values
+
+        t = last
+
+    return (pd.Series(fund_values, index=dates[window_days:]),
+            pd.DataFrame(allocations, index=rebalance_dates, columns=symbols))
 
-    print 'Best Sharpe Ratio: ', best_sharpe_ratio
-    print 'Best allocation: ', best_opt
-    
-    
 
 def main():
 
@@ -290,7 +775,12 @@ def main():
         enddate = dt.datetime(2011, 12, 31)
         symbols = ['AAPL', 'GLD', 'GOOG', 'XOM'  ]
         allocations = [0.4, 0.4, 0.0, 0.2]
-        simulate(startdate, enddate, symbols, allocations)
+        # example [daily|weekly|monthly|legacy]
+        rebalance = sys.argv[2] if len(sys.argv) > 2 else None
+        if rebalance is not None and rebalance.lower() == 'legacy':
+            simulate(startdate, enddate, symbols, allocations, legacy=True)
+        else:
+            simulate(startdate, enddate, symbols, allocations, rebalance)
 
     elif sys.argv[1].lower() == 'lesson':
         startdate = dt.datetime(2011, 1, 1)
@@ -299,6 +789,36 @@ def main():
         allocations = [0.6, 0.4]# 0.0, 0.2]
         simulate(startdate, enddate, symbols, allocations)
 
+    elif sys.argv[1].lower() == 'optimize':
+        startdate = dt.datetime(2011, 1, 1)
+        enddate = dt.datetime(2011, 12, 31)
+        symbols = ['AAPL', 'GLD', 'GOOG', 'XOM'  ]
+        step = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+        rebalance = sys.argv[3] if len(sys.argv) > 3 else None
+        optimizer(startdate, enddate, symbols, step, rebalance=rebalance)
+
+    elif sys.argv[1].lower() == 'continuous':
+        startdate = dt.datetime(2011, 1, 1)
+        enddate = dt.datetime(2011, 12, 31)
+        symbols = ['AAPL', 'GLD', 'GOOG', 'XOM'  ]
+        optimizer(startdate, enddate, symbols, method='continuous')
+
+    elif sys.argv[1].lower() == 'walkforward':
+        # Walk forward: re-fit on the trailing year every month, 10 years out of sample
+        startdate = dt.datetime(2001, 1, 1)
+        enddate = dt.datetime(2011, 12, 31)
+        symbols = ['AAPL', 'GLD', 'GOOG', 'XOM'  ]
+        window_days = int(sys.argv[2]) if len(sys.argv) > 2 else 252
+        rebalance_days = int(sys.argv[3]) if len(sys.argv) > 3 else 21
+        fund_values, allocations = walk_forward(startdate, enddate, symbols, window_days, rebalance_days)
+
+        daily_ret_values = (fund_values.values[1:] / fund_values.values[:-1]) - 1
+        print 'Out of sample Sharpe Ratio: ', sharpe_ratio_calc(mean_returns_calc(daily_ret_values),
+                                                                stddev_returns_calc(daily_ret_values))
+        print 'Out of sample cumulative return: ', fund_values.values[-1]
+        print 'Re-optimizations: ', len(allocations)
+        print 'Last allocation: ', allocations.values[-1]
+
     
     
 
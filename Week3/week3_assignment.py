@@ -14,238 +14,129 @@ import sys
 # NumPy import
 import numpy as np
 
-#print "Pandas Version", pd.__version__
-
-def sharpe_ratio_calc(mean_returns, stddev_returns,  frequency='daily'):
-    num_trading_days = 252
-    num_trading_weeks = 52
-
-    if frequency is 'daily':
-        multiplier = np.sqrt(num_trading_days)
-    elif frequency is 'weekly':
-        multiplier = np.sqrt(num_trading_weeks)
-    
-    sharpe_ratio = multiplier * (mean_returns/stddev_returns)
-
-    return sharpe_ratio
-
-
-def simulate(startdate, enddate, symbols, allocations):
-    #print startdate, ' ', enddate,' ',  symbols, ' ', allocations
-    
-    keys = ['open', 'high', 'low', 'close', 'volume', 'actual_close']
-    num_symbols = len(symbols)
-
-    time_of_day = dt.timedelta(hours=16)
-    timestamps = du.getNYSEdays(startdate, enddate, time_of_day)
-    
-    symbol_data_obj = da.DataAccess('Yahoo', cachestalltime=0)
-    symbol_data = symbol_data_obj.get_data(timestamps, symbols, keys)
-    symbol_data_dict = dict(zip(keys, symbol_data))
+# Shared price cache
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+import price_cache as pc
 
-    close_values = symbol_data_dict['close'].values
-    #print 'Close values\n', close_values
-    normalized_close_values = close_values / close_values[0, :]
-    daily_ret_values = normalized_close_values.copy()
-    tsu.returnize0(daily_ret_values)
+# Process pool for running the questions in parallel
+import multiprocessing
 
-    #print daily_ret_values
-    num_trading_days = len(daily_ret_values)
-
-    cum_ret = np.ones((num_trading_days, num_symbols))
-    mult_cum_ret = np.ones((num_trading_days, num_symbols))
-
-    for symb_index in range(num_symbols):
-        mult_cum_ret[0][symb_index] =  allocations[symb_index]
-
-
-    for symb_index in range(num_symbols):
-        for index in range(1, num_trading_days):
-            cum_ret[index][symb_index] = np.sum(daily_ret_values[index][symb_index] + cum_ret[index - 1][symb_index])
-            mult_cum_ret[index][symb_index] = cum_ret[index][symb_index] * allocations[symb_index]
-
-    #print 'Cumulative returns: \n', cum_ret
-    #print 'Post allocations: \n', mult_cum_ret
-
-    total_fund_cum_ret = 0
-    for symb_index in range(num_symbols):
-        total_fund_cum_ret = total_fund_cum_ret + mult_cum_ret[num_trading_days - 1][symb_index]
+# Batch / grid optimizer
+import optimizer as op
 
+#print "Pandas Version", pd.__version__
 
-    #print 'Total cumulative return: ', total_fund_cum_ret
-    
-    total_fund_daily_cum_ret = np.zeros((num_trading_days))
-    for index in range(num_trading_days):
-        total_fund_daily_cum_ret[index] = np.sum(mult_cum_ret[index, :])
+# The assignment's cumulative returns: every symbol starts at 1 and adds its
+# daily returns up (no compounding), and the fund is the allocation weighted
+# sum of those columns. The optimizer values a fund the same way from the
+# normalized close values, so scoring it on this frame instead of the close
+# values gives the assignment's Sharpe ratios
 
+def cumulative_returns_frame(close_frame):
 
-    #print 'Total fund daily cumulative return: \n', total_fund_daily_cum_ret
-    total_fund_daily_ret = total_fund_daily_cum_ret.copy()
-    tsu.returnize0(total_fund_daily_ret)
+    daily_returns = close_frame.values / close_frame.values[0, :]
+    tsu.returnize0(daily_returns)
+    return pd.DataFrame(1 + np.cumsum(daily_returns, axis=0), index=close_frame.index, columns=close_frame.columns)
 
-    #print 'Total fund daily returns: \n', total_fund_daily_ret
 
-    mean_returns = np.average(total_fund_daily_ret)
-    stddev_returns = np.std(total_fund_daily_ret)
-    sharpe_ratio = sharpe_ratio_calc(mean_returns, stddev_returns)
+# Price panels loaded by run_jobs, keyed by (startdate, enddate). Filled in before
+# the pool is created so the forked workers share them instead of reloading
+shared_panels = {}
+shared_jobs = []
 
-    #print 'Sharpe Ratio: ', sharpe_ratio
-    #print 'Std dev: ', stddev_returns
-    #print 'Average: ', mean_returns
-    #print 'Total cumulative return: ', total_fund_cum_ret
-    
-    return (mean_returns, stddev_returns, sharpe_ratio, total_fund_cum_ret)
 
+# Loads one filled panel per date range, covering the union of the symbols of
+# every job in that range. The close frames are read here, in the parent, since
+# op.initialize only returns a lazy PricePanel; otherwise every forked worker
+# would do its own load
 
-def get_digits(number):
-    
-    number_copy = number
-    number_arr = []
+def load_panels(jobs):
 
-    while number_copy > 0:
-        number_arr.append(number_copy % 10)
-        number_copy = number_copy/10
+    symbols_per_range = {}
+    for startdate, enddate, symbols in jobs:
+        symbols_per_range.setdefault((startdate, enddate), set()).update(symbols)
 
+    for date_range in symbols_per_range:
+        startdate, enddate = date_range
+        panel = op.initialize(startdate, enddate, sorted(symbols_per_range[date_range]))
+        shared_panels[date_range] = {'close': panel['close']}
 
-    #print number_arr
-    return number_arr
 
+# Worker: runs the optimizer for one distinct job against the shared panel,
+# scored on the assignment's cumulative returns
 
+def run_job(job_args):
 
+    job_index, step, method = job_args
+    startdate, enddate, symbols = shared_jobs[job_index]
 
-def optimizer(startdate, enddate, symbols):
+    panel = shared_panels[(startdate, enddate)]
+    symbol_data_dict = {'close': cumulative_returns_frame(panel['close'][list(symbols)])}
 
-    best_sharpe_ratio = 0
-    best_opt = []
-    delta = 0.1
-    delta_array = [0.0 + i*delta for i in range(0, 11)]
+    return op.optimizer(startdate, enddate, list(symbols), step, method=method,
+                        symbol_data_dict=symbol_data_dict, verbose=False)
 
-    allocation = np.zeros((len(symbols)))
-    possible_allocations = []
 
-    num_symbols = len(symbols)
-    lower = np.power(10, num_symbols - 1 )
-    higher = np.power(10, len(symbols) ) - 1
+# Takes a list of (startdate, enddate, symbols) jobs
+# Runs the optimizer once per distinct job across a process pool, loading each
+# date range only once for all the jobs that share it
+# Returns the (best sharpe ratio, best allocation) results in the order of the jobs
 
-    #print lower, higher
+def run_jobs(jobs, step=0.1, method='grid', processes=None):
 
-    for i in range(lower, higher):
-        arr = get_digits(i)
-        div_arr = arr
-        if np.sum(arr) == 10:
-            div_arr[:] = [x / 10.0 for x in arr]
-            possible_allocations.append(div_arr)
+    keyed_jobs = [(startdate, enddate, tuple(symbols)) for startdate, enddate, symbols in jobs]
 
-    for index in range(len(symbols)):
-        ones_alloc = np.zeros((len(symbols)))
-        ones_alloc[index] = 1.0
-        possible_allocations.append(ones_alloc)
+    del shared_jobs[:]
+    job_indexes = {}
+    for job in keyed_jobs:
+        if job not in job_indexes:
+            job_indexes[job] = len(shared_jobs)
+            shared_jobs.append(job)
 
+    shared_panels.clear()
+    load_panels(shared_jobs)
 
-    #print possible_allocations
-    for alloc in range(len(possible_allocations)):
-        mean, stddev, sharpe, cum_ret = simulate(startdate, enddate, symbols, possible_allocations[alloc])
-        if sharpe > best_sharpe_ratio:
-            best_sharpe_ratio = sharpe
-            best_opt = possible_allocations[alloc]
-#            print best_sharpe_ratio, best_opt
+    pool = multiprocessing.Pool(processes)
+    try:
+        distinct_results = pool.map(run_job, [(index, step, method) for index in range(len(shared_jobs))])
+    finally:
+        pool.close()
+        pool.join()
 
+    return [distinct_results[job_indexes[job]] for job in keyed_jobs]
 
-    print 'Best Sharpe Ratio: ', best_sharpe_ratio
-    print 'Best allocation: ', best_opt
-    
-    
 
 def main():
 
-    #Q1 
-
-    startdate = dt.datetime(2011, 1, 1)
-    enddate = dt.datetime(2011, 12, 31)
-    symbols = ['AAPL', 'GOOG', 'IBM', 'MSFT' ]
-    print "Question 2:"
-    optimizer(startdate, enddate, symbols)
-    print "\n\n"
-
-    #Q2 
-    startdate = dt.datetime(2010, 1, 1)
-    enddate = dt.datetime(2010, 12, 31)
-    symbols = ['BRCM', 'ADBE', 'AMD', 'ADI' ]
-    print "Question 2:"
-    optimizer(startdate, enddate, symbols)
-    print "\n\n"
-   
-    #Q3 
-    startdate = dt.datetime(2011, 1, 1)
-    enddate = dt.datetime(2011, 12, 31)
-    symbols = ['BRCM', 'TXN', 'AMD', 'ADI' ]
-    print "Question 3:"
-    optimizer(startdate, enddate, symbols)
-    print "\n\n"
-
-    #Q4 
-    startdate = dt.datetime(2010, 1, 1)
-    enddate = dt.datetime(2010, 12, 31)
-    symbols = ['BRCM', 'TXN', 'IBM', 'HNZ' ]
-    print "Question 4:"
-    optimizer(startdate, enddate, symbols)
-    print "\n\n"
-
-    #Q5 
-    startdate = dt.datetime(2010, 1, 1)
-    enddate = dt.datetime(2010, 12, 31)
-    symbols = ['C', 'GS', 'IBM', 'HNZ' ]
-    print "Question 5:"
-    optimizer(startdate, enddate, symbols)
-    print "\n\n"
-
-    #Q6 
-    startdate = dt.datetime(2011, 1, 1)
-    enddate = dt.datetime(2011, 12, 31)
-    symbols = ['AAPL', 'GOOG', 'IBM', 'MSFT' ]
-    print "Question 6:"
-    optimizer(startdate, enddate, symbols)
-    print "\n\n"
-
-
-    #Q7 
-    startdate = dt.datetime(2011, 1, 1)
-    enddate = dt.datetime(2011, 12, 31)
-    symbols = ['BRCM', 'ADBE', 'AMD', 'ADI' ]
-    print "Question 7:"
-    optimizer(startdate, enddate, symbols)
-    print "\n\n"
-
-    #Q8 
-    startdate = dt.datetime(2011, 1, 1)
-    enddate = dt.datetime(2011, 12, 31)
-    symbols = ['BRCM', 'TXN', 'AMD', 'ADI' ]
-    print "Question 8:"
-    optimizer(startdate, enddate, symbols)
-    print "\n\n"
-
-
-    #Q9 
-    startdate = dt.datetime(2010, 1, 1)
-    enddate = dt.datetime(2010, 12, 31)
-    symbols = ['BRCM', 'TXN', 'IBM', 'HNZ' ]
-    print "Question 9:"
-    optimizer(startdate, enddate, symbols)
-    print "\n\n"
-
-    #Q10 
-    startdate = dt.datetime(2010, 1, 1)
-    enddate = dt.datetime(2010, 12, 31)
-    symbols = ['C', 'GS', 'IBM', 'HNZ' ]
-    print "Question 10:"
-    optimizer(startdate, enddate, symbols)
-    print "\n\n"
-
-
-
-
-    #simulate(startdate, enddate, symbols, allocations)
-    
+    year_2010 = (dt.datetime(2010, 1, 1), dt.datetime(2010, 12, 31))
+    year_2011 = (dt.datetime(2011, 1, 1), dt.datetime(2011, 12, 31))
+
+    questions = [
+        year_2011 + (['AAPL', 'GOOG', 'IBM', 'MSFT' ],),    #Q1
+        year_2010 + (['BRCM', 'ADBE', 'AMD', 'ADI' ],),     #Q2
+        year_2011 + (['BRCM', 'TXN', 'AMD', 'ADI' ],),      #Q3
+        year_2010 + (['BRCM', 'TXN', 'IBM', 'HNZ' ],),      #Q4
+        year_2010 + (['C', 'GS', 'IBM', 'HNZ' ],),          #Q5
+        year_2011 + (['AAPL', 'GOOG', 'IBM', 'MSFT' ],),    #Q6
+        year_2011 + (['BRCM', 'ADBE', 'AMD', 'ADI' ],),     #Q7
+        year_2011 + (['BRCM', 'TXN', 'AMD', 'ADI' ],),      #Q8
+        year_2010 + (['BRCM', 'TXN', 'IBM', 'HNZ' ],),      #Q9
+        year_2010 + (['C', 'GS', 'IBM', 'HNZ' ],),          #Q10
+    ]
+
+    # Scored on the assignment's cumulative returns over the whole 10% grid. The
+    # old digit by digit enumeration skipped every allocation with 0% in the
+    # last symbol except the single symbol ones, so an answer like
+    # [0.8, 0.2, 0, 0] can now come out where it used to be unreachable
+    results = run_jobs(questions)
+
+    for question in range(len(questions)):
+        best_sharpe_ratio, best_opt = results[question]
+        print "Question %d:" % (question + 1)
+        print 'Best Sharpe Ratio: ', best_sharpe_ratio
+        print 'Best allocation: ', best_opt
+        print "\n\n"
 
 
 if __name__ == "__main__":
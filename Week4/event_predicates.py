@@ -0,0 +1,307 @@
+'''
+Composable event definitions for the event profiler.
+
+Each predicate turns the price panel into a (days x symbols) boolean matrix
+with whole-frame array operations. Predicates combine with & (AND) and | (OR):
+
+    evp.PriceCrossesBelow(10.0) & evp.MarketRelativeReturnBelow(-0.05)
+
+evaluate_events() runs a (combined) predicate over the panel in one pass.
+Derived series such as returns, the market return or the volume average are
+computed once per EventContext, as are the masks of the individual predicates,
+so evaluate_many() can screen many definitions over the same panel without
+recomputing anything they share.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+class EventContext(object):
+    ''' Panel being screened plus every derived series computed from it so far '''
+
+    def __init__(self, d_data, ls_symbols, s_market_sym='SPY'):
+        self.d_data = d_data
+        self.ls_symbols = list(ls_symbols)
+        self.s_market_sym = s_market_sym
+        self.d_series = {}
+        self.d_masks = {}
+
+        # Dates of the panel, taken from the first frame read
+        self.ldt_index = None
+
+    def frame(self, s_key):
+        df_frame = self.d_data[s_key]
+        if self.ldt_index is None:
+            self.ldt_index = df_frame.index
+        return df_frame
+
+    def cached(self, t_name, fn_compute):
+        if t_name not in self.d_series:
+            self.d_series[t_name] = fn_compute()
+        return self.d_series[t_name]
+
+    def price(self, s_key):
+        ''' Today's values, days x symbols '''
+        return self.cached(('price', s_key),
+                           lambda: self.frame(s_key)[self.ls_symbols].values.astype(float))
+
+    def price_yest(self, s_key):
+        ''' Previous day's values, NaN on the first day '''
+        def compute():
+            na_price = self.price(s_key)
+            na_yest = np.empty(na_price.shape)
+            na_yest[0, :] = np.NAN
+            na_yest[1:, :] = na_price[:-1, :]
+            return na_yest
+        return self.cached(('price_yest', s_key), compute)
+
+    def returns(self, s_key):
+        ''' Daily returns, NaN on the first day '''
+        return self.cached(('returns', s_key),
+                           lambda: (self.price(s_key) / self.price_yest(s_key)) - 1)
+
+    def market_returns(self, s_key):
+        ''' Daily returns of the market symbol as a (days x 1) column '''
+        def compute():
+            na_market = self.frame(s_key)[self.s_market_sym].values.astype(float)
+            na_returns = np.empty((len(na_market), 1))
+            na_returns[0, 0] = np.NAN
+            na_returns[1:, 0] = (na_market[1:] / na_market[:-1]) - 1
+            return na_returns
+        return self.cached(('market_returns', s_key), compute)
+
+    def trailing_average(self, s_key, i_window):
+        ''' Average of the i_window days before today, NaN until there are enough days '''
+        def compute():
+            na_price = self.price(s_key)
+            na_cumsum = np.zeros((na_price.shape[0] + 1, na_price.shape[1]))
+            na_cumsum[1:, :] = np.cumsum(na_price, axis=0)
+            na_average = np.empty(na_price.shape)
+            na_average[:i_window, :] = np.NAN
+            na_average[i_window:, :] = (na_cumsum[i_window:-1, :] - na_cumsum[:-i_window - 1, :]) / i_window
+            return na_average
+        return self.cached(('trailing_average', s_key, i_window), compute)
+
+
+class EventPredicate(object):
+    ''' Base class; subclasses implement compute() and params() '''
+
+    def params(self):
+        return ()
+
+    def key(self):
+        return (self.__class__.__name__,) + tuple(self.params())
+
+    def compute(self, context):
+        raise NotImplementedError
+
+    def mask(self, context):
+        t_key = self.key()
+        if t_key not in context.d_masks:
+            with np.errstate(invalid='ignore'):
+                context.d_masks[t_key] = self.compute(context)
+        return context.d_masks[t_key]
+
+    def __and__(self, other):
+        return AllOf(self, other)
+
+    def __or__(self, other):
+        return AnyOf(self, other)
+
+
+class AllOf(EventPredicate):
+    ''' Event when every one of the predicates holds '''
+
+    def __init__(self, *l_predicates):
+        self.l_predicates = []
+        for predicate in l_predicates:
+            if isinstance(predicate, AllOf):
+                self.l_predicates.extend(predicate.l_predicates)
+            else:
+                self.l_predicates.append(predicate)
+
+    def params(self):
+        return tuple(predicate.key() for predicate in self.l_predicates)
+
+    def compute(self, context):
+        na_mask = self.l_predicates[0].mask(context).copy()
+        for predicate in self.l_predicates[1:]:
+            na_mask &= predicate.mask(context)
+        return na_mask
+
+
+class AnyOf(EventPredicate):
+    ''' Event when at least one of the predicates holds '''
+
+    def __init__(self, *l_predicates):
+        self.l_predicates = []
+        for predicate in l_predicates:
+            if isinstance(predicate, AnyOf):
+                self.l_predicates.extend(predicate.l_predicates)
+            else:
+                self.l_predicates.append(predicate)
+
+    def params(self):
+        return tuple(predicate.key() for predicate in self.l_predicates)
+
+    def compute(self, context):
+        na_mask = self.l_predicates[0].mask(context).copy()
+        for predicate in self.l_predicates[1:]:
+            na_mask |= predicate.mask(context)
+        return na_mask
+
+
+class PriceCrossesBelow(EventPredicate):
+    ''' Price >= threshold the previous day and < threshold today '''
+
+    def __init__(self, f_threshold, s_key='actual_close'):
+        self.f_threshold = f_threshold
+        self.s_key = s_key
+
+    def params(self):
+        return (self.f_threshold, self.s_key)
+
+    def compute(self, context):
+        return (context.price_yest(self.s_key) >= self.f_threshold) & \
+               (context.price(self.s_key) < self.f_threshold)
+
+
+class PriceCrossesAbove(EventPredicate):
+    ''' Price < threshold the previous day and >= threshold today '''
+
+    def __init__(self, f_threshold, s_key='actual_close'):
+        self.f_threshold = f_threshold
+        self.s_key = s_key
+
+    def params(self):
+        return (self.f_threshold, self.s_key)
+
+    def compute(self, context):
+        return (context.price_yest(self.s_key) < self.f_threshold) & \
+               (context.price(self.s_key) >= self.f_threshold)
+
+
+class ReturnBelow(EventPredicate):
+    ''' Symbol's daily return <= f_return (e.g. -0.05 for a 5% drop) '''
+
+    def __init__(self, f_return, s_key='actual_close'):
+        self.f_return = f_return
+        self.s_key = s_key
+
+    def params(self):
+        return (self.f_return, self.s_key)
+
+    def compute(self, context):
+        return context.returns(self.s_key) <= self.f_return
+
+
+class ReturnAbove(EventPredicate):
+    ''' Symbol's daily return >= f_return '''
+
+    def __init__(self, f_return, s_key='actual_close'):
+        self.f_return = f_return
+        self.s_key = s_key
+
+    def params(self):
+        return (self.f_return, self.s_key)
+
+    def compute(self, context):
+        return context.returns(self.s_key) >= self.f_return
+
+
+class MarketReturnBelow(EventPredicate):
+    ''' Market symbol's daily return <= f_return, for every symbol that day '''
+
+    def __init__(self, f_return, s_key='actual_close'):
+        self.f_return = f_return
+        self.s_key = s_key
+
+    def params(self):
+        return (self.f_return, self.s_key)
+
+    def compute(self, context):
+        na_market = context.market_returns(self.s_key) <= self.f_return
+        return np.repeat(na_market, len(context.ls_symbols), axis=1)
+
+
+class MarketReturnAbove(EventPredicate):
+    ''' Market symbol's daily return >= f_return, for every symbol that day '''
+
+    def __init__(self, f_return, s_key='actual_close'):
+        self.f_return = f_return
+        self.s_key = s_key
+
+    def params(self):
+        return (self.f_return, self.s_key)
+
+    def compute(self, context):
+        na_market = context.market_returns(self.s_key) >= self.f_return
+        return np.repeat(na_market, len(context.ls_symbols), axis=1)
+
+
+class MarketRelativeReturnBelow(EventPredicate):
+    ''' Symbol's daily return minus the market's <= f_return '''
+
+    def __init__(self, f_return, s_key='actual_close'):
+        self.f_return = f_return
+        self.s_key = s_key
+
+    def params(self):
+        return (self.f_return, self.s_key)
+
+    def compute(self, context):
+        return (context.returns(self.s_key) - context.market_returns(self.s_key)) <= self.f_return
+
+
+class MarketRelativeReturnAbove(EventPredicate):
+    ''' Symbol's daily return minus the market's >= f_return '''
+
+    def __init__(self, f_return, s_key='actual_close'):
+        self.f_return = f_return
+        self.s_key = s_key
+
+    def params(self):
+        return (self.f_return, self.s_key)
+
+    def compute(self, context):
+        return (context.returns(self.s_key) - context.market_returns(self.s_key)) >= self.f_return
+
+
+class VolumeSpike(EventPredicate):
+    ''' Today's volume >= f_multiple times the average of the previous i_window days '''
+
+    def __init__(self, f_multiple, i_window=20, s_key='volume'):
+        self.f_multiple = f_multiple
+        self.i_window = i_window
+        self.s_key = s_key
+
+    def params(self):
+        return (self.f_multiple, self.i_window, self.s_key)
+
+    def compute(self, context):
+        return context.price(self.s_key) >= self.f_multiple * context.trailing_average(self.s_key, self.i_window)
+
+
+def mask_to_events(na_mask, context):
+    ''' NaN/1 event matrix (days x symbols) as used by the event profiler '''
+    return pd.DataFrame(np.where(na_mask, 1.0, np.NAN), index=context.ldt_index, columns=context.ls_symbols)
+
+
+def evaluate_events(predicate, d_data, ls_symbols, s_market_sym='SPY', context=None):
+    ''' Runs a (combined) predicate over the panel, returns the NaN/1 event matrix '''
+    if context is None:
+        context = EventContext(d_data, ls_symbols, s_market_sym)
+
+    na_mask = predicate.mask(context)
+    return mask_to_events(na_mask, context)
+
+
+def evaluate_many(d_predicates, d_data, ls_symbols, s_market_sym='SPY'):
+    ''' Runs every named predicate over one shared context, returns name -> event matrix '''
+    context = EventContext(d_data, ls_symbols, s_market_sym)
+
+    d_events = {}
+    for s_name in d_predicates:
+        d_events[s_name] = evaluate_events(d_predicates[s_name], d_data, ls_symbols, s_market_sym, context)
+    return d_events
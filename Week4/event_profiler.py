@@ -12,9 +12,16 @@ import QSTK.qstkutil.qsdateutil as du
 import datetime as dt
 import QSTK.qstkutil.DataAccess as da
 import QSTK.qstkutil.tsutil as tsu
-import QSTK.qstkstudy.EventProfiler as ep
+import event_predicates as evp
+import event_study as evs
 
 import sys
+import multiprocessing
+
+# Shared price cache
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+import price_cache as pc
 
 """
 Accepts a list of symbols along with start and end date
@@ -33,44 +40,162 @@ nan = no information about any event.
 """
 
 
-def find_events(ls_symbols, d_data):
+def find_events(ls_symbols, d_data, f_threshold=10.0):
     ''' Finding the event dataframe '''
     df_close = d_data['actual_close']
-    ts_market = df_close['SPY']
 
     print "Finding Events"
 
+    # Event is found if the symbol price is >= threshold the previous day
+    # and is less than threshold today (whole-frame comparison)
+    predicate = evp.PriceCrossesBelow(f_threshold, 'actual_close')
+
     # Creating an empty dataframe
-    df_events = copy.deepcopy(df_close)
-    df_events = df_events * np.NAN
+    df_events = df_close * np.NAN
+    df_events[ls_symbols] = evp.evaluate_events(predicate, d_data, ls_symbols)
 
-    # Time stamps for the event range
-    ldt_timestamps = df_close.index
+    return df_events
 
-    for s_sym in ls_symbols:
-        for i in range(1, len(ldt_timestamps)):
-            # Calculating the returns for this timestamp
-            f_symprice_today = df_close[s_sym].ix[ldt_timestamps[i]]
-            f_symprice_yest = df_close[s_sym].ix[ldt_timestamps[i - 1]]
-            f_marketprice_today = ts_market.ix[ldt_timestamps[i]]
-            f_marketprice_yest = ts_market.ix[ldt_timestamps[i - 1]]
-            f_symreturn_today = (f_symprice_today / f_symprice_yest) - 1
-            f_marketreturn_today = (f_marketprice_today / f_marketprice_yest) - 1
 
-            # Event is found if the symbol price is >= $5.0 the previous day
-            # and is less than $5.00 today
+def find_events_sweep(ls_symbols, d_data, lf_thresholds):
+    ''' Event masks for every threshold in one batched comparison,
+    shaped (thresholds x days x symbols) '''
+    na_price = d_data['actual_close'][ls_symbols].values
+    na_thresholds = np.asarray(lf_thresholds, dtype=float)[:, np.newaxis, np.newaxis]
+
+    na_events = np.zeros((len(na_thresholds),) + na_price.shape, dtype=bool)
+    na_events[:, 1:, :] = (na_price[np.newaxis, :-1, :] >= na_thresholds) & \
+                          (na_price[np.newaxis, 1:, :] < na_thresholds)
+
+    return na_events
+
+
+def sweep_events(ls_symbols, d_data, lf_thresholds, li_lookbacks, li_lookforwards,
+                 s_pdf_prefix=None, s_market_sym='SPY'):
+    ''' Runs the price-drop study for every threshold and every
+    lookback/lookforward window on data that is loaded once.
+    Returns a summary table with the event count and the mean market neutral
+    return before and after the event per configuration. A PDF per
+    configuration is only written when s_pdf_prefix is given '''
+    na_rets, ls_columns = evs.abnormal_returns(d_data, 'close', True, s_market_sym)
+    t_growth = evs.log_growth(na_rets)
+
+    ls_event_symbols = [s_sym for s_sym in ls_symbols if s_sym in ls_columns]
+    na_symbol_cols = np.array([ls_columns.index(s_sym) for s_sym in ls_event_symbols], dtype=int)
+
+    na_events = find_events_sweep(ls_event_symbols, d_data, lf_thresholds)
+    na_groups, na_rows, na_syms = np.nonzero(na_events)
+    na_cols = na_symbol_cols[na_syms]
+
+    l_rows = []
+    for i_lookback in li_lookbacks:
+        for i_lookforward in li_lookforwards:
+            na_counts, na_lookback_means, na_lookforward_means = evs.window_summary(
+                t_growth, na_groups, na_rows, na_cols, len(lf_thresholds), i_lookback, i_lookforward)
+            for i_threshold in range(len(lf_thresholds)):
+                l_rows.append((lf_thresholds[i_threshold], i_lookback, i_lookforward, na_counts[i_threshold],
+                               na_lookback_means[i_threshold], na_lookforward_means[i_threshold]))
+
+    df_summary = pd.DataFrame(l_rows, columns=['threshold', 'lookback', 'lookforward', 'events',
+                                               'mean_lookback_return', 'mean_lookforward_return'])
+
+    if s_pdf_prefix is not None:
+        ldt_timestamps = d_data['actual_close'].index
+        for i_threshold in range(len(lf_thresholds)):
+            df_events = pd.DataFrame(np.where(na_events[i_threshold], 1.0, np.NAN),
+                                     index=ldt_timestamps, columns=ls_event_symbols)
+            for i_lookback in li_lookbacks:
+                for i_lookforward in li_lookforwards:
+                    filename = '%s_%g_%d_%d.pdf' % (s_pdf_prefix, lf_thresholds[i_threshold], i_lookback, i_lookforward)
+                    evs.event_profile(df_events, d_data, i_lookback=i_lookback, i_lookforward=i_lookforward,
+                                      b_market_neutral=True, s_market_sym=s_market_sym,
+                                      s_filename=filename, b_errorbars=True)
+
+    return df_summary
+
+
+# Market series loaded by parallel_event_study before the pool forks, read (never
+# written) by the shard workers: timestamps, market frames per key, market returns
+d_shared = {}
+
+
+def shard_study(t_task):
+    ''' Worker: loads one shard of a symbol list, finds its events and returns
+    the window sums of its market neutral profile '''
+    s_list, ls_shard, predicate, ls_keys, i_lookback, i_lookforward = t_task
+    s_market_sym = d_shared['market_sym']
+
+    d_data = pc.get_data(d_shared['timestamps'], ls_shard, ls_keys)
+    d_panel = {}
+    for s_key in ls_keys:
+        d_panel[s_key] = pd.concat([d_data[s_key], d_shared['market'][s_key]], axis=1)
 
-            if f_symprice_yest >= 10.0 and f_symprice_today < 10.0:
-                df_events[s_sym].ix[ldt_timestamps[i]] = 1
-            
+    df_events = evp.evaluate_events(predicate, d_panel, ls_shard, s_market_sym)
+
+    na_rets = evs.daily_returns(d_data['close'].values) - d_shared['market_rets'][:, np.newaxis]
+    t_growth = evs.log_growth(na_rets)
+    na_rows, na_cols = np.nonzero(df_events.values == 1)
+
+    na_sums, na_squares, i_num_events = evs.window_sums(t_growth, na_rows, na_cols, i_lookback, i_lookforward)
+    return (s_list, na_sums, na_squares, i_num_events)
 
-    return df_events
+
+def parallel_event_study(ls_lists, ldt_timestamps, predicate=None, i_lookback=20, i_lookforward=20,
+                         i_shard_size=50, i_processes=None, s_market_sym='SPY', ls_keys=['actual_close', 'close']):
+    ''' Runs the market neutral event study for every symbol list, split into
+    shards of i_shard_size symbols. The shards of all the lists go through one
+    process pool so the cores stay busy, and their sums are merged per list.
+    Returns a dictionary of list -> (profile DataFrame, number of events) '''
+    if predicate is None:
+        predicate = evp.PriceCrossesBelow(10.0, 'actual_close')
+    if 'close' not in ls_keys:
+        ls_keys = list(ls_keys) + ['close']
+
+    dataobj = da.DataAccess('Yahoo')
+    d_market = pc.get_data(ldt_timestamps, [s_market_sym], ls_keys)
+
+    d_shared.clear()
+    d_shared['timestamps'] = ldt_timestamps
+    d_shared['market_sym'] = s_market_sym
+    d_shared['market'] = dict((s_key, d_market[s_key]) for s_key in ls_keys)
+    d_shared['market_rets'] = evs.daily_returns(d_market['close'][s_market_sym].values)
+
+    l_tasks = []
+    for s_list in ls_lists:
+        ls_symbols = [s_sym for s_sym in dataobj.get_symbols_from_list(s_list) if s_sym != s_market_sym]
+        for i_first in range(0, len(ls_symbols), i_shard_size):
+            l_tasks.append((s_list, ls_symbols[i_first:i_first + i_shard_size], predicate,
+                            ls_keys, i_lookback, i_lookforward))
+
+    i_window = i_lookback + i_lookforward + 1
+    d_sums = dict((s_list, [np.zeros(i_window), np.zeros(i_window), 0]) for s_list in ls_lists)
+
+    pool = multiprocessing.Pool(i_processes)
+    try:
+        for s_list, na_sums, na_squares, i_num_events in pool.imap_unordered(shard_study, l_tasks):
+            d_sums[s_list][0] += na_sums
+            d_sums[s_list][1] += na_squares
+            d_sums[s_list][2] += i_num_events
+    finally:
+        pool.close()
+        pool.join()
+
+    d_profiles = {}
+    for s_list in ls_lists:
+        na_sums, na_squares, i_num_events = d_sums[s_list]
+        d_profiles[s_list] = (evs.profile_from_sums(na_sums, na_squares, i_num_events, i_lookback, i_lookforward),
+                              i_num_events)
+    return d_profiles
 
 
 if __name__ == '__main__':
 
     question_num = sys.argv[1]
     data_list = sys.argv[2]
+
+    # Optional columnar price store (see Common/price_store.py)
+    if len(sys.argv) > 3:
+        pc.use_price_store(sys.argv[3])
     
     
 
@@ -78,22 +203,35 @@ if __name__ == '__main__':
     dt_end = dt.datetime(2009, 12, 31)
     ldt_timestamps = du.getNYSEdays(dt_start, dt_end, dt.timedelta(hours=16))
 
+    if question_num.lower() == 'parallel':
+        # Comma separated lists, e.g. sp5002008,sp5002012, studied together
+        ls_lists = data_list.split(',')
+        d_profiles = parallel_event_study(ls_lists, ldt_timestamps)
+        for s_list in ls_lists:
+            df_profile, i_num_events = d_profiles[s_list]
+            print s_list, ':', i_num_events, 'events'
+            print df_profile.to_string()
+        sys.exit(0)
+
     dataobj = da.DataAccess('Yahoo')
     ls_symbols = dataobj.get_symbols_from_list(data_list)
     ls_symbols.append('SPY')
 
-    ls_keys = ['open', 'high', 'low', 'close', 'volume', 'actual_close']
-    ldf_data = dataobj.get_data(ldt_timestamps, ls_symbols, ls_keys)
-    d_data = dict(zip(ls_keys, ldf_data))
-
-    for s_key in ls_keys:
-        d_data[s_key] = d_data[s_key].fillna(method='ffill')
-        d_data[s_key] = d_data[s_key].fillna(method='bfill')
-        d_data[s_key] = d_data[s_key].fillna(1.0)
-
-    df_events = find_events(ls_symbols, d_data)
-    print "Creating Study"
-    filename = question_num + '.pdf'
-    ep.eventprofiler(df_events, d_data, i_lookback=20, i_lookforward=20,
-                s_filename=filename, b_market_neutral=True, b_errorbars=True,
-                s_market_sym='SPY')
+    # find_events reads actual_close and the event profiler close
+    ls_keys = ['actual_close', 'close']
+    d_data = pc.get_data(ldt_timestamps, ls_symbols, ls_keys)
+
+    if question_num.lower() == 'sweep':
+        # 50 thresholds, data loaded once; summary only, no PDFs
+        lf_thresholds = list(np.arange(5.0, 15.0, 0.2))
+        df_summary = sweep_events(ls_symbols, d_data, lf_thresholds, [20], [5, 10, 20])
+        print df_summary.to_string()
+        df_summary.to_csv('sweep.csv', index=False)
+    else:
+        df_events = find_events(ls_symbols, d_data)
+        print "Creating Study"
+        filename = question_num + '.pdf'
+        df_profile, i_num_events = evs.event_profile(df_events, d_data, i_lookback=20, i_lookforward=20,
+                    b_market_neutral=True, s_market_sym='SPY', s_filename=filename, b_errorbars=True)
+        print i_num_events, 'events'
+        print df_profile.to_string()
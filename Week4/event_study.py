@@ -0,0 +1,180 @@
+'''
+Array based event study statistics, computed without a loop over the events.
+
+event_profile() is the in-project counterpart of QSTK's eventprofiler: it
+returns the mean, standard deviation and standard error curves around the
+events as a DataFrame, and only plots when asked to.
+
+The (market neutral) daily returns are turned into a running log-growth
+series once. The return over any window is then a difference of two entries
+of that series, so every event's window return comes from one fancy-indexing
+operation over the event coordinates. Growth factors (1 + return) that are
+negative or zero, e.g. a -95% day against a rising market, are tracked as
+running counts next to the logs of the absolute factors, so the window values
+stay finite and match eventprofiler's per-window cumprod; a -100% day zeroes
+the growth across it.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+def daily_returns(na_close):
+    ''' Daily returns along the first axis, first day 0 (like returnize0) '''
+    na_close = na_close.astype(float)
+    na_rets = np.zeros(na_close.shape)
+    na_rets[1:] = (na_close[1:] / na_close[:-1]) - 1
+    return na_rets
+
+
+def abnormal_returns(d_data, s_key='close', b_market_neutral=True, s_market_sym='SPY'):
+    ''' Daily returns (first day 0), minus the market's if market neutral.
+    Returns the (days x symbols) array and its symbols; the market symbol is
+    dropped when market neutral, as in QSTK's eventprofiler '''
+    df_close = d_data[s_key]
+    na_rets = daily_returns(df_close.values)
+
+    ls_columns = list(df_close.columns)
+    if b_market_neutral:
+        i_market = ls_columns.index(s_market_sym)
+        na_rets = na_rets - na_rets[:, i_market:i_market + 1]
+        na_rets = np.delete(na_rets, i_market, axis=1)
+        del ls_columns[i_market]
+
+    return (na_rets, ls_columns)
+
+
+def log_growth(na_rets):
+    ''' Running sums along the days of log|1 + r| (zero factors skipped), of
+    the number of negative factors and of the number of zero factors, as a
+    (log, negatives, zeros) tuple; see growth_ratio '''
+    na_factors = 1 + na_rets
+    na_abs = np.abs(na_factors)
+    na_log = np.cumsum(np.log(np.where(na_abs > 0, na_abs, 1.0)), axis=0)
+    na_negatives = np.cumsum(na_factors < 0, axis=0)
+    na_zeros = np.cumsum(na_factors == 0, axis=0)
+    return (na_log, na_negatives, na_zeros)
+
+
+def growth_ratio(t_growth, na_rows_to, na_rows_from, na_cols):
+    ''' Growth from day na_rows_from to day na_rows_to (the product of the
+    factors in between, or its inverse going backwards), for any broadcastable
+    index arrays. A zero factor in between gives 0 forwards and inf backwards,
+    the same as dividing the cumprods '''
+    na_log, na_negatives, na_zeros = t_growth
+    na_ratio = np.exp(na_log[na_rows_to, na_cols] - na_log[na_rows_from, na_cols])
+
+    na_flips = (na_negatives[na_rows_to, na_cols] - na_negatives[na_rows_from, na_cols]) % 2 == 1
+    na_ratio = np.where(na_flips, -na_ratio, na_ratio)
+
+    na_zeros_between = na_zeros[na_rows_to, na_cols] - na_zeros[na_rows_from, na_cols]
+    return np.where(na_zeros_between > 0, 0.0, np.where(na_zeros_between < 0, np.inf, na_ratio))
+
+
+def num_days(t_growth):
+    ''' Number of days covered by a log_growth result '''
+    return t_growth[0].shape[0]
+
+
+def valid_events(na_rows, i_num_days, i_lookback, i_lookforward):
+    ''' Events with a full window on both sides, like eventprofiler keeps '''
+    return (na_rows >= i_lookback) & (na_rows < i_num_days - i_lookforward)
+
+
+def event_coordinates(df_events, ls_columns):
+    ''' Day and symbol positions of every event, aligned on ls_columns '''
+    na_events = df_events.reindex(columns=ls_columns).values
+    return np.nonzero(na_events == 1)
+
+
+def window_returns(t_growth, na_rows, na_cols, i_lookback, i_lookforward):
+    ''' Per event: return from i_lookback days before the event up to the event
+    day, and from the event day to i_lookforward days after '''
+    na_lookback_rets = growth_ratio(t_growth, na_rows, na_rows - i_lookback, na_cols) - 1
+    na_lookforward_rets = growth_ratio(t_growth, na_rows + i_lookforward, na_rows, na_cols) - 1
+    return (na_lookback_rets, na_lookforward_rets)
+
+
+def window_summary(t_growth, na_groups, na_rows, na_cols, i_num_groups, i_lookback, i_lookforward):
+    ''' For events tagged with a group number (e.g. the threshold they belong
+    to), returns per group: event count, mean lookback return and mean
+    lookforward return, all groups in one pass '''
+    na_valid = valid_events(na_rows, num_days(t_growth), i_lookback, i_lookforward)
+    na_groups = na_groups[na_valid]
+    na_lookback_rets, na_lookforward_rets = window_returns(t_growth, na_rows[na_valid], na_cols[na_valid],
+                                                           i_lookback, i_lookforward)
+
+    na_counts = np.bincount(na_groups, minlength=i_num_groups)
+    na_lookback_sums = np.bincount(na_groups, weights=na_lookback_rets, minlength=i_num_groups)
+    na_lookforward_sums = np.bincount(na_groups, weights=na_lookforward_rets, minlength=i_num_groups)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        na_lookback_means = na_lookback_sums / na_counts
+        na_lookforward_means = na_lookforward_sums / na_counts
+
+    return (na_counts, na_lookback_means, na_lookforward_means)
+
+
+def window_curves(t_growth, na_rows, na_cols, i_lookback, i_lookforward):
+    ''' (events x window) growth curves normalized to 1.0 on the event day, the
+    same curves eventprofiler draws, gathered with one fancy-indexing pass '''
+    na_offsets = np.arange(-i_lookback, i_lookforward + 1)
+    return growth_ratio(t_growth, na_rows[:, np.newaxis] + na_offsets, na_rows[:, np.newaxis],
+                        na_cols[:, np.newaxis])
+
+
+def window_sums(t_growth, na_rows, na_cols, i_lookback, i_lookforward):
+    ''' Sum and sum of squares of the curves of every event with a full window,
+    plus the event count. Sums from different shards can simply be added '''
+    na_valid = valid_events(na_rows, num_days(t_growth), i_lookback, i_lookforward)
+    na_curves = window_curves(t_growth, na_rows[na_valid], na_cols[na_valid], i_lookback, i_lookforward)
+    return (na_curves.sum(axis=0), (na_curves * na_curves).sum(axis=0), len(na_curves))
+
+
+def profile_from_sums(na_sums, na_squares, i_num_events, i_lookback, i_lookforward):
+    ''' Mean, standard deviation and standard error of the curves per day
+    offset, as a DataFrame indexed by offset from the event day '''
+    with np.errstate(invalid='ignore', divide='ignore'):
+        na_mean = na_sums / i_num_events
+        na_std = np.sqrt(np.maximum(na_squares / i_num_events - na_mean * na_mean, 0.0))
+        na_stderr = na_std / np.sqrt(i_num_events)
+
+    df_profile = pd.DataFrame({'mean': na_mean, 'std': na_std, 'stderr': na_stderr},
+                              index=np.arange(-i_lookback, i_lookforward + 1),
+                              columns=['mean', 'std', 'stderr'])
+    df_profile.index.name = 'offset'
+    return df_profile
+
+
+def plot_profile(df_profile, i_num_events, s_filename, b_errorbars=True):
+    ''' Draws the profile to a file the way eventprofiler does '''
+    import matplotlib.pyplot as plt
+
+    plt.clf()
+    plt.axhline(y=1.0, color='k')
+    if b_errorbars:
+        plt.errorbar(df_profile.index, df_profile['mean'], yerr=df_profile['std'], ecolor='#AAAAFF', alpha=0.1)
+    plt.plot(df_profile.index, df_profile['mean'], linewidth=3, label='mean', color='b')
+    plt.xlim(df_profile.index[0] - 1, df_profile.index[-1] + 1)
+    plt.title('Market Relative mean return of ' + str(i_num_events) + ' events')
+    plt.xlabel('Days')
+    plt.ylabel('Cumulative Returns')
+    plt.savefig(s_filename, format='pdf')
+
+
+def event_profile(df_events, d_data, i_lookback=20, i_lookforward=20, b_market_neutral=True,
+                  s_market_sym='SPY', s_filename=None, b_errorbars=True):
+    ''' In-project replacement for QSTK's eventprofiler.
+    Returns (profile DataFrame, number of events); the PDF is only drawn when
+    s_filename is given '''
+    na_rets, ls_columns = abnormal_returns(d_data, 'close', b_market_neutral, s_market_sym)
+    t_growth = log_growth(na_rets)
+    na_rows, na_cols = event_coordinates(df_events, ls_columns)
+
+    na_sums, na_squares, i_num_events = window_sums(t_growth, na_rows, na_cols, i_lookback, i_lookforward)
+    df_profile = profile_from_sums(na_sums, na_squares, i_num_events, i_lookback, i_lookforward)
+
+    if s_filename is not None:
+        plot_profile(df_profile, i_num_events, s_filename, b_errorbars)
+
+    return (df_profile, i_num_events)
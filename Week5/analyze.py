@@ -20,18 +20,137 @@ import csv
 # Defaultdict to initialize empty dictionary
 from collections import defaultdict
 
+# Shared price cache
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+import price_cache as pc
+import values_io
+
+
+# Function: daily_returns_matrix
+# Description:
+#   Takes a (days x series) matrix of values
+#   Returns the daily returns of every column, first day 0 (like returnize0)
+
+def daily_returns_matrix(value_matrix):
+
+    value_matrix = np.asarray(value_matrix, dtype=float)
+    returns = np.zeros(value_matrix.shape)
+    returns[1:] = value_matrix[1:] / value_matrix[:-1] - 1
+    return returns
+
+
+# Function: drawdowns
+# Description:
+#   Takes a (days x series) matrix of values
+#   Returns the max drawdown (negative, fraction of the peak) of every column and
+#   the duration of that drawdown in trading days, from the peak before it to
+#   the first day back at the peak's value (or to the last day if it never got
+#   back there)
+
+def drawdowns(value_matrix):
+
+    num_days, num_series = value_matrix.shape
+    columns = np.arange(num_series)
+
+    running_max = np.maximum.accumulate(value_matrix, axis=0)
+    drawdown = value_matrix / running_max - 1
+    trough = drawdown.argmin(axis=0)
+    max_drawdown = drawdown[trough, columns]
+
+    # Position of the last peak on or before every day
+    day_numbers = np.arange(num_days)[:, np.newaxis]
+    last_peak = np.maximum.accumulate(np.where(value_matrix >= running_max, day_numbers, 0), axis=0)
+    peak = last_peak[trough, columns]
+
+    # First day after the trough back at the peak value
+    recovered = (value_matrix >= running_max[trough, columns]) & (day_numbers > trough)
+    recovery = np.where(recovered.any(axis=0), recovered.argmax(axis=0), num_days - 1)
+    max_duration = np.where(max_drawdown < 0, recovery - peak, 0)
+
+    return (max_drawdown, max_duration)
+
+
+# Function: performance_metrics
+# Description:
+#   Takes a (days x series) matrix of fund values, a (days x benchmarks) matrix
+#   of benchmark values over the same days, and optionally their names
+#   Computes the metrics of every column in one pass over the matrices: total
+#   return, average and standard deviation of the daily returns, Sharpe and
+#   Sortino ratios, max drawdown and its duration, and for every (fund,
+#   benchmark) pair beta, alpha, tracking error and information ratio
+#   Average, standard deviation, alpha and tracking error are daily; Sharpe,
+#   Sortino and information ratio are annualized with sqrt(252)
+#   Returns a DataFrame of the single series metrics (funds then benchmarks) and
+#   a DataFrame of the relative metrics indexed by (fund, benchmark)
+
+def performance_metrics(value_matrix, benchmark_matrix, names=None, benchmark_names=None):
+
+    value_matrix = np.asarray(value_matrix, dtype=float).reshape(len(value_matrix), -1)
+    benchmark_matrix = np.asarray(benchmark_matrix, dtype=float).reshape(len(benchmark_matrix), -1)
+    num_funds = value_matrix.shape[1]
+    num_days = value_matrix.shape[0]
+
+    if names is None:
+        names = ['fund_%d' % idx for idx in range(num_funds)]
+    if benchmark_names is None:
+        benchmark_names = ['benchmark_%d' % idx for idx in range(benchmark_matrix.shape[1])]
+
+    all_values = np.hstack((value_matrix, benchmark_matrix))
+    returns = daily_returns_matrix(all_values)
+
+    average = returns.mean(axis=0)
+    centered = returns - average
+    variance = np.einsum('ij,ij->j', centered, centered) / num_days
+    stddev = np.sqrt(variance)
+    downside = np.sqrt(np.einsum('ij,ij->j', np.minimum(returns, 0), np.minimum(returns, 0)) / num_days)
+    max_drawdown, max_duration = drawdowns(all_values)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sharpe = np.sqrt(252) * average / stddev
+        sortino = np.sqrt(252) * average / downside
+
+    single = pd.DataFrame({'total_return': all_values[-1] / all_values[0], 'average': average, 'stddev': stddev,
+                           'sharpe': sharpe, 'sortino': sortino, 'max_drawdown': max_drawdown,
+                           'max_drawdown_duration': max_duration},
+                          index=list(names) + list(benchmark_names),
+                          columns=['total_return', 'average', 'stddev', 'sharpe', 'sortino',
+                                   'max_drawdown', 'max_drawdown_duration'])
+
+    # (funds x benchmarks) covariances of the daily returns
+    covariance = np.dot(centered[:, :num_funds].T, centered[:, num_funds:]) / num_days
+    fund_average = average[:num_funds, np.newaxis]
+    fund_variance = variance[:num_funds, np.newaxis]
+    benchmark_average = average[np.newaxis, num_funds:]
+    benchmark_variance = variance[np.newaxis, num_funds:]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        beta = covariance / benchmark_variance
+        alpha = fund_average - beta * benchmark_average
+        tracking_error = np.sqrt(np.maximum(fund_variance + benchmark_variance - 2 * covariance, 0.0))
+        information_ratio = np.sqrt(252) * (fund_average - benchmark_average) / tracking_error
+
+    pairs = pd.MultiIndex.from_product([list(names), list(benchmark_names)], names=['fund', 'benchmark'])
+    relative = pd.DataFrame({'beta': beta.ravel(), 'alpha': alpha.ravel(), 'tracking_error': tracking_error.ravel(),
+                             'information_ratio': information_ratio.ravel()},
+                            index=pairs, columns=['beta', 'alpha', 'tracking_error', 'information_ratio'])
+
+    return (single, relative)
+
+
+# Function: get_fund_properties
+# Description:
+#   Takes the values of one fund
+#   Returns the average and standard deviation of its daily returns and its
+#   Sharpe ratio
 
 def get_fund_properties(cumulative_returns):
 
-    total_fund_daily_return = []
-    for d in range(len(cumulative_returns)):
-        total_fund_daily_return.append(float(cumulative_returns[d] / cumulative_returns[0]))
+    returns = daily_returns_matrix(np.asarray(cumulative_returns, dtype=float).reshape(len(cumulative_returns), -1))[:, 0]
 
-    total_fund_daily_return = tsu.returnize0(total_fund_daily_return)
-
-    fund_average = np.average(total_fund_daily_return)
-    fund_stddev = np.std(total_fund_daily_return)
-    fund_sharpe_ratio = np.sqrt(252) * (fund_average / fund_stddev) 
+    fund_average = np.average(returns)
+    fund_stddev = np.std(returns)
+    fund_sharpe_ratio = np.sqrt(252) * (fund_average / fund_stddev)
 
     return (fund_average, fund_stddev, fund_sharpe_ratio)
 
@@ -45,59 +164,56 @@ def main():
     symbols_list = []
     symbols_list.append(benchmark_symbol)
 
-    all_dates = []
-    fund_daily_total = []
-    
-    reader = csv.reader(open(values_file, 'rU'), delimiter=',')
-
-    # Scan the CSV file and store are relevant informaton
-    for row in reader:
-        year = int(row[0])
-        month = int(row[1])
-        date = int(row[2])
-        fund_returns = float(row[3])
-
-        full_date = dt.datetime(year, month, date, 16)
-        all_dates.append(full_date)
-        fund_daily_total.append(fund_returns)
+    # CSV or binary (.npy) values file, see Common/values_io.py
+    all_dates, fund_values, names = values_io.read_values(values_file)
 
     first_date = all_dates[0]
     last_date = all_dates[len(all_dates) - 1]
 
    
     # Getting the benchmark symbol's close values
-    keys = ['open', 'high', 'low', 'close', 'volume', 'actual_close']
+    keys = ['close']
     
     time_of_day = dt.timedelta(hours=16)
     timestamps = du.getNYSEdays(first_date, last_date, time_of_day)
     
-    symbol_data_obj = da.DataAccess('Yahoo', cachestalltime=0)
-    symbol_data = symbol_data_obj.get_data(timestamps, symbols_list, keys)
-    symbol_data_dict = dict(zip(keys, symbol_data))
+    symbol_data_dict = pc.get_data(timestamps, symbols_list, keys)
+
+    close_values = symbol_data_dict['close'].reindex(all_dates).values
 
-    close_values = symbol_data_dict['close'].values
-  
-    # Calculating the cumulative return ratio for the fund and benchmark
-    total_fund_cum_return = fund_daily_total[len(fund_daily_total) - 1] / fund_daily_total[0]
-    total_benchmark_cum_return = float(close_values[len(close_values) - 1] / close_values[0])
+    # Several series (e.g. a batch of strategies): one table for all of them
+    if len(names) > 1:
+        single, relative = performance_metrics(fund_values, close_values, names, [benchmark_symbol])
+        print single.to_string()
+        print relative.to_string()
+        return
 
-    # Getting rest of the properties for the fund and benchmark
-    fund_average, fund_stddev, fund_sharpe_ratio = get_fund_properties(fund_daily_total) 
-    benchmark_average, benchmark_stddev, benchmark_sharpe_ratio = get_fund_properties(close_values)
+    single, relative = performance_metrics(fund_values, close_values, ['fund'], [benchmark_symbol])
+    fund = single.loc['fund']
+    benchmark = single.loc[benchmark_symbol]
+    fund_relative = relative.loc[('fund', benchmark_symbol)]
 
     print '\n'
 
-    print "Total fund return: ", total_fund_cum_return
-    print "Fund average daily return: ", fund_average
-    print "Fund standard deviation of returns: ", fund_stddev
-    print "Fund Sharpe Ratio: ", fund_sharpe_ratio
+    print "Total fund return: ", fund['total_return']
+    print "Fund average daily return: ", fund['average']
+    print "Fund standard deviation of returns: ", fund['stddev']
+    print "Fund Sharpe Ratio: ", fund['sharpe']
+    print "Fund Sortino Ratio: ", fund['sortino']
+    print "Fund max drawdown: ", fund['max_drawdown'], "lasting", int(fund['max_drawdown_duration']), "days from peak to recovery"
+    print "Fund beta: ", fund_relative['beta']
+    print "Fund alpha (daily): ", fund_relative['alpha']
+    print "Fund tracking error: ", fund_relative['tracking_error']
+    print "Fund information ratio: ", fund_relative['information_ratio']
 
     print '\n\n'
 
-    print "Total benchmark return: ", total_benchmark_cum_return
-    print "benchmark average daily return: ", benchmark_average
-    print "benchmark standard deviation of returns: ", benchmark_stddev
-    print "benchmark Sharpe Ratio: ", benchmark_sharpe_ratio
+    print "Total benchmark return: ", benchmark['total_return']
+    print "benchmark average daily return: ", benchmark['average']
+    print "benchmark standard deviation of returns: ", benchmark['stddev']
+    print "benchmark Sharpe Ratio: ", benchmark['sharpe']
+    print "benchmark Sortino Ratio: ", benchmark['sortino']
+    print "benchmark max drawdown: ", benchmark['max_drawdown'], "lasting", int(benchmark['max_drawdown_duration']), "days from peak to recovery"
 
     print '\n'
 
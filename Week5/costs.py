@@ -0,0 +1,115 @@
+'''
+Transaction cost models for the vectorized market simulator.
+
+A cost model turns the (days x symbols) matrices the simulator already has --
+shares traded, number of orders, close and volume -- into a (days x symbols)
+matrix of costs with whole-matrix array operations, so a cost adjusted run
+costs about as much as a frictionless one. The simulator subtracts the
+running sum of the costs from cash.
+
+Models add up with +:
+
+    costs.FixedCost(9.95) + costs.BasisPointsCost(5) + costs.MarketImpactCost(0.1)
+
+On the command line a model is written as e.g. fixed:9.95,bps:5,impact:0.1
+'''
+
+import numpy as np
+
+
+class CostModel:
+
+    # True if costs() needs the volume matrix
+    needs_volume = False
+
+    # Takes the shares traded (absolute, buys and sells both counted), the number
+    # of orders, and the close and volume values, all (days x symbols)
+    # Returns the (days x symbols) costs
+    def costs(self, traded_shares, trade_counts, close_values, volume_values):
+        raise NotImplementedError
+
+    def __add__(self, other):
+        return CombinedCost(self, other)
+
+
+class CombinedCost(CostModel):
+
+    def __init__(self, *models):
+        self.models = []
+        for model in models:
+            if isinstance(model, CombinedCost):
+                self.models.extend(model.models)
+            else:
+                self.models.append(model)
+        self.needs_volume = any(model.needs_volume for model in self.models)
+
+    def costs(self, traded_shares, trade_counts, close_values, volume_values):
+        total = np.zeros(traded_shares.shape)
+        for model in self.models:
+            total += model.costs(traded_shares, trade_counts, close_values, volume_values)
+        return total
+
+
+class FixedCost(CostModel):
+
+    # A flat commission per order
+    def __init__(self, per_trade):
+        self.per_trade = per_trade
+
+    def costs(self, traded_shares, trade_counts, close_values, volume_values):
+        return self.per_trade * trade_counts
+
+
+class BasisPointsCost(CostModel):
+
+    # A fraction of the notional traded, in basis points (1 bp = 0.01%)
+    def __init__(self, bps):
+        self.bps = bps
+
+    def costs(self, traded_shares, trade_counts, close_values, volume_values):
+        return (self.bps / 10000.0) * traded_shares * close_values
+
+
+class MarketImpactCost(CostModel):
+
+    # Price impact proportional to the share of the day's volume traded:
+    # notional * coefficient * shares / volume. The volume comes filled like the
+    # prices (see price_cache.fill_frame): a gap in a symbol's volume takes the
+    # nearest day's, and a symbol with no volume data at all is all 1.0. A
+    # volume of 1 share or less is taken as that missing data and costs nothing,
+    # rather than an impact of shares squared
+    needs_volume = True
+
+    def __init__(self, coefficient):
+        self.coefficient = coefficient
+
+    def costs(self, traded_shares, trade_counts, close_values, volume_values):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            participation = np.where(volume_values > 1, traded_shares / volume_values, 0.0)
+        return self.coefficient * participation * traded_shares * close_values
+
+
+# Function: parse_cost_model
+# Description:
+#   Takes a cost spec like 'fixed:9.95,bps:5,impact:0.1'
+#   Returns the (combined) CostModel, or None for an empty spec or 'none'
+
+def parse_cost_model(spec):
+
+    model_types = {'fixed': FixedCost, 'bps': BasisPointsCost, 'impact': MarketImpactCost}
+
+    models = []
+    for term in spec.split(','):
+        term = term.strip()
+        if term == '' or term.lower() == 'none':
+            continue
+        name, _, value = term.partition(':')
+        if name.lower() not in model_types:
+            raise ValueError('Unknown cost model: %s' % name)
+        models.append(model_types[name.lower()](float(value)))
+
+    if len(models) == 0:
+        return None
+    if len(models) == 1:
+        return models[0]
+    return CombinedCost(*models)
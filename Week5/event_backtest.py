@@ -0,0 +1,105 @@
+'''
+Event study -> orders -> fund values -> analysis in one process.
+
+The event matrix from find_events is turned into buy / hold N days / sell
+order book in memory and handed straight to the market simulator, instead
+of writing an orders CSV for marketsim to parse back.
+
+Usage: python event_backtest.py <symbol list> <initial cash> [threshold] [hold days] [shares]
+'''
+
+# Third Party Imports
+import datetime as dt
+import numpy as np
+
+# Command Line inputs
+import sys
+
+# Week 4 event study and week 5 simulator/analyzer
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Week4'))
+import event_profiler as evprof
+import marketsim as ms
+import analyze as an
+import price_cache as pc
+
+
+# Function: event_orders
+# Description:
+#   Takes an event matrix (NaN/1, days x symbols), the number of trading days to
+#   hold and the number of shares per event
+#   Buys on every event day and sells hold_days trading days later, or on the
+#   last day if that is sooner
+#   Returns parallel arrays of order dates, symbols, order types and shares,
+#   sorted by date
+
+def event_orders(df_events, hold_days=5, shares=100):
+
+    event_rows, event_cols = np.nonzero(df_events.values == 1)
+    sell_rows = np.minimum(event_rows + hold_days, len(df_events.index) - 1)
+
+    timestamps = df_events.index.to_pydatetime()
+    symbols = np.asarray(df_events.columns, dtype=object)
+    num_events = len(event_rows)
+
+    order_rows = np.concatenate((event_rows, sell_rows))
+    order_dates = timestamps[order_rows]
+    order_symbols = np.concatenate((symbols[event_cols], symbols[event_cols]))
+    order_types = np.array(['Buy'] * num_events + ['Sell'] * num_events, dtype=object)
+    order_shares = np.empty(2 * num_events, dtype=int)
+    order_shares[:] = shares
+
+    by_date = np.argsort(order_rows, kind='mergesort')
+
+    return (order_dates[by_date], order_symbols[by_date], order_types[by_date], order_shares[by_date])
+
+
+# Function: run_backtest
+# Description:
+#   Takes the starting cash and the order arrays
+#   Encodes them as an OrderBook and runs the vectorized simulator on it
+#   Returns the dates and the total fund value on each of them
+
+def run_backtest(initial_sum, order_dates, order_symbols, order_types, order_shares):
+
+    order_book = ms.order_book_from_arrays(order_dates, order_symbols, order_types, order_shares)
+    fund_values = ms.simulate_orders_vectorized(initial_sum, order_book)
+
+    return (list(fund_values.index), list(fund_values['value'].values))
+
+
+def main():
+
+    data_list = sys.argv[1]
+    initial_sum = int(sys.argv[2])
+    threshold = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+    hold_days = int(sys.argv[4]) if len(sys.argv) > 4 else 5
+    shares = int(sys.argv[5]) if len(sys.argv) > 5 else 100
+
+    startdate = dt.datetime(2008, 1, 1)
+    enddate = dt.datetime(2009, 12, 31)
+
+    symbols = pc.shared_cache.data_access().get_symbols_from_list(data_list)
+    timestamps, symbol_data_dict = pc.load_data(startdate, enddate, symbols, ['actual_close'])
+
+    df_events = evprof.find_events(symbols, symbol_data_dict, threshold)
+    order_dates, order_symbols, order_types, order_shares = event_orders(df_events, hold_days, shares)
+
+    # No events at this threshold: nothing to simulate, the cash just stays put
+    if len(order_dates) == 0:
+        print "Orders: ", 0
+        print "No events at threshold", threshold, "- the fund stays flat at", initial_sum
+        return
+
+    dates, fund_values = run_backtest(initial_sum, order_dates, order_symbols, order_types, order_shares)
+    fund_average, fund_stddev, fund_sharpe_ratio = an.get_fund_properties(fund_values)
+
+    print "Orders: ", len(order_dates)
+    print "Total fund return: ", fund_values[-1] / fund_values[0]
+    print "Fund average daily return: ", fund_average
+    print "Fund standard deviation of returns: ", fund_stddev
+    print "Fund Sharpe Ratio: ", fund_sharpe_ratio
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,15 @@ import csv
 # Defaultdict to initialize empty dictionary
 from collections import defaultdict
 
+# Shared price cache
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'Common'))
+import price_cache as pc
+import values_io
+
+# Transaction cost models
+import costs
+
 ''' 
 Algorithm:
 	Scan the command line arguments, get the initial sum, the orders.csv, 
@@ -83,9 +92,67 @@ class Portfolio:
         print 'Portfolio Total: ', self.total
 
 
+class IncrementalPortfolio(Portfolio):
+
+    # Keeps holdings_total and total as running sums, so a fill or a price tick
+    # only touches the symbol it is for, and total_calc does not sum over every
+    # holding. Positions (long or short) are marked at the last price seen
+
+    def __init__(self, cash_amount, holdings_total):
+        Portfolio.__init__(self, cash_amount, holdings_total)
+        self.shares_per_symbol = {}
+        self.last_price = {}
+
+    def remark(self, symb):
+        old_holding = self.holdings_per_symbol.get(symb, 0)
+        new_holding = self.shares_per_symbol.get(symb, 0) * self.last_price[symb]
+        self.holdings_per_symbol[symb] = new_holding
+        self.holdings_total += new_holding - old_holding
+        self.total = self.cash_amount + self.holdings_total
+
+    # A price tick for one symbol
+    def mark(self, symb, price):
+        self.last_price[symb] = price
+        if self.shares_per_symbol.get(symb, 0) != 0:
+            self.remark(symb)
+        return self.total
+
+    # A fill of num_of_shares at price, order_type 'Buy' or 'Sell'
+    def fill(self, symb, order_type, num_of_shares, price):
+        if order_type == 'Buy':
+            signed_shares = num_of_shares
+        elif order_type == 'Sell':
+            signed_shares = -num_of_shares
+        else:
+            raise ValueError('Unknown order type: %s' % order_type)
+
+        self.shares_per_symbol[symb] = self.shares_per_symbol.get(symb, 0) + signed_shares
+        self.cash_amount -= signed_shares * price
+        self.last_price[symb] = price
+        self.remark(symb)
+        return self.total
+
+    # One bar: the prices of the symbols that changed since the last bar, then
+    # the orders filled at those prices (or the last price seen)
+    # Returns the total fund value after the bar
+    def append_bar(self, prices, orders=[]):
+        for symb in prices:
+            self.mark(symb, prices[symb])
+        for order in orders:
+            self.fill(order.symbol, order.order_type, order.num_of_shares, self.last_price[order.symbol])
+        return self.total
+
+    def total_calc(self):
+        return self.total
+
+    # Rebuilds the running sums from the holdings, to drop accumulated rounding
+    def resync(self):
+        return Portfolio.total_calc(self)
+
+
 def execute_order(order, shares_per_symbol, database, portfolio):
 
-	price = database[3][order.symbol][order.full_date]
+	price = database['close'][order.symbol][order.full_date]
 
 	if order.order_type == 'Buy':
             if order.symbol in shares_per_symbol:
@@ -93,8 +160,8 @@ def execute_order(order, shares_per_symbol, database, portfolio):
             else:
                 shares_per_symbol[order.symbol] = order.num_of_shares
 
-            if shares_per_symbol[order.symbol] > 0:
-                portfolio.holdings_per_symbol[order.symbol] = shares_per_symbol[order.symbol] * price
+            # Longs, flat and shorts (a buy can cover a short) are all marked
+            portfolio.holdings_per_symbol[order.symbol] = shares_per_symbol[order.symbol] * price
 	    
             portfolio.cash_amount = portfolio.cash_amount - (order.num_of_shares * price)
 
@@ -102,33 +169,27 @@ def execute_order(order, shares_per_symbol, database, portfolio):
             
             if order.symbol in shares_per_symbol:
                 shares_per_symbol[order.symbol] -= order.num_of_shares
-                portfolio.holdings_per_symbol[order.symbol] = shares_per_symbol[order.symbol] * price
             else:
-                print 'shorting'
+                # Shorting: the position is held (and marked) as negative shares
                 shares_per_symbol[order.symbol] = -(order.num_of_shares)
 
-            
+            portfolio.holdings_per_symbol[order.symbol] = shares_per_symbol[order.symbol] * price
+
             portfolio.cash_amount = portfolio.cash_amount + (order.num_of_shares * price)
 
         return portfolio
 
 
 
-def main():
-
-	initial_sum = int(sys.argv[1])
-	orders_file = sys.argv[2]
-	values_file = sys.argv[3]
-
-	keys = ['open', 'high', 'low', 'close', 'volume', 'actual_close']
-
-        p = Portfolio(initial_sum, 0)
+# Function: read_orders
+# Description:
+#   Takes the orders CSV file
+#   Returns the orders mapped by date and by symbol
 
-	fund_daily_returns = {}
+def read_orders(orders_file):
 
 	orders_dict_by_date = defaultdict(list)
 	orders_dict_by_symbol = defaultdict(list)
-        shares_per_symbol = {}
 
 	reader = csv.reader(open(orders_file, 'rU'), delimiter=',')
 
@@ -150,6 +211,25 @@ def main():
 		#order.print_order()
 		#print order.full_date
 
+	return (orders_dict_by_date, orders_dict_by_symbol)
+
+
+# Function: simulate_orders
+# Description:
+#   Takes the starting cash and the orders mapped by date and by symbol
+#   Runs the orders day by day from the first to the last order date
+#   Returns the total fund value keyed by date
+
+def simulate_orders(initial_sum, orders_dict_by_date, orders_dict_by_symbol):
+
+	keys = ['close']
+
+        p = Portfolio(initial_sum, 0)
+
+	fund_daily_returns = {}
+
+        shares_per_symbol = {}
+
 	dates_list = sorted(orders_dict_by_date)
 	first_date = dates_list[0]
 	last_date = dates_list[len(dates_list) - 1]
@@ -160,10 +240,9 @@ def main():
 	time_of_day = dt.timedelta(hours=16)
 	timestamps = du.getNYSEdays(first_date, last_date, time_of_day)
 
-	symbol_data_obj = da.DataAccess('Yahoo', cachestalltime=0)
-	symbol_data = symbol_data_obj.get_data(timestamps, symbols_list, keys)
+	symbol_data = pc.get_data(timestamps, symbols_list, keys)
 
-	#print symbol_data[3]['AAPL'][first_date]
+	#print symbol_data['close']['AAPL'][first_date]
 	
 	
         delta = dt.timedelta(days=1)
@@ -177,17 +256,448 @@ def main():
                     p = execute_order(o, shares_per_symbol, symbol_data, p)
             else: 
                 for symb in shares_per_symbol:
-                    if shares_per_symbol[symb] > 0:
-                        p.holdings_per_symbol[symb] = shares_per_symbol[symb] * symbol_data[3][symb][timestamps[idx]]
+                    if shares_per_symbol[symb] != 0:
+                        p.holdings_per_symbol[symb] = shares_per_symbol[symb] * symbol_data['close'][symb][timestamps[idx]]
 
 
             fund_daily_returns[d] = p.total_calc()
 
+        return fund_daily_returns
+
+
+# Class: OrderBook
+# Description:
+#   Columnar replacement for lists of Orders objects. Every order is a position
+#   into the sorted order days (int32), a position into the sorted symbols
+#   (int16), a side (int8: 1 buy, -1 sell) and a number of shares, so an order
+#   takes 15 bytes instead of an object with its own __dict__
+
+class OrderBook:
+
+    def __init__(self, order_days, date_codes, symbols, symbol_codes, sides, shares):
+        self.order_days = order_days
+        self.date_codes = date_codes
+        self.symbols = symbols
+        self.symbol_codes = symbol_codes
+        self.sides = sides
+        self.shares = shares
+
+    def __len__(self):
+        return len(self.shares)
+
+    def first_date(self):
+        return self.order_days[0]
+
+    def last_date(self):
+        return self.order_days[-1]
+
+    def signed_shares(self):
+        return self.sides * self.shares
+
+    # (days x symbols) matrix of the per order weights summed by day and symbol,
+    # on the given trading days and symbols. Orders on days that are not trading
+    # days are dropped, same as the day by day loop skips them
+    def day_symbol_sums(self, timestamps, symbols_list, weights):
+        dates_index = pd.DatetimeIndex(timestamps)
+        day_positions = dates_index.get_indexer(pd.DatetimeIndex(self.order_days))
+        column_positions = pd.Index(symbols_list).get_indexer(self.symbols)
+
+        date_idx = day_positions[self.date_codes]
+        on_trading_day = date_idx >= 0
+
+        sums = np.zeros((len(timestamps), len(symbols_list)))
+        np.add.at(sums, (date_idx[on_trading_day], column_positions[self.symbol_codes[on_trading_day]]),
+                  weights[on_trading_day])
+
+        return sums
+
+    # Signed shares traded, buys positive and sells negative
+    def trades(self, timestamps, symbols_list):
+        return self.day_symbol_sums(timestamps, symbols_list, self.signed_shares())
+
+    # Shares traded whatever the side, so a buy and a sell on the same day both count
+    def traded_shares(self, timestamps, symbols_list):
+        return self.day_symbol_sums(timestamps, symbols_list, self.shares * (self.sides != 0))
+
+    # Number of orders
+    def trade_counts(self, timestamps, symbols_list):
+        return self.day_symbol_sums(timestamps, symbols_list, (self.sides != 0).astype(np.int64))
+
+
+# Function: order_book_from_arrays
+# Description:
+#   Takes parallel arrays (or lists) of order dates (datetimes at 1600 hrs),
+#   symbols, order types ('Buy'/'Sell') and numbers of shares
+#   Returns them encoded as an OrderBook
+
+def order_book_from_arrays(order_dates, order_symbols, order_types, order_shares):
+
+    order_days, date_codes = np.unique(np.asarray(order_dates, dtype=object), return_inverse=True)
+    symbols, symbol_codes = np.unique(np.asarray(order_symbols, dtype=object), return_inverse=True)
+    if len(symbols) > np.iinfo(np.int16).max:
+        raise ValueError('Too many symbols for an OrderBook: %d' % len(symbols))
+
+    order_types = np.asarray(order_types, dtype=object)
+    sides = np.where(order_types == 'Buy', 1, np.where(order_types == 'Sell', -1, 0)).astype(np.int8)
+
+    return OrderBook(list(order_days), date_codes.astype(np.int32), list(symbols), symbol_codes.astype(np.int16),
+                     sides, np.asarray(order_shares, dtype=np.int64))
+
+
+# Function: read_order_book
+# Description:
+#   Takes the orders CSV file (year, month, day, symbol, Buy/Sell, shares)
+#   Parses it in one bulk read instead of row by row
+#   Returns the orders as an OrderBook
+
+def read_order_book(orders_file):
+
+    orders = pd.read_csv(orders_file, header=None, usecols=range(6),
+                         names=['year', 'month', 'day', 'symbol', 'order_type', 'shares'],
+                         dtype={'symbol': str, 'order_type': str}, skipinitialspace=True)
+
+    # Dates are only converted to datetimes once per distinct day
+    yyyymmdd = orders['year'].values * 10000 + orders['month'].values * 100 + orders['day'].values
+    unique_days, date_codes = np.unique(yyyymmdd, return_inverse=True)
+    order_days = [dt.datetime(d // 10000, d // 100 % 100, d % 100, 16) for d in unique_days]
+
+    symbols, symbol_codes = np.unique(orders['symbol'].values, return_inverse=True)
+    if len(symbols) > np.iinfo(np.int16).max:
+        raise ValueError('Too many symbols for an OrderBook: %d' % len(symbols))
+
+    order_types = orders['order_type'].values
+    sides = np.where(order_types == 'Buy', 1, np.where(order_types == 'Sell', -1, 0)).astype(np.int8)
+
+    return OrderBook(order_days, date_codes.astype(np.int32), list(symbols), symbol_codes.astype(np.int16),
+                     sides, orders['shares'].values.astype(np.int64))
+
+
+# Function: vectorized_values
+# Description:
+#   Takes the starting cash, the trade matrix, the close values (days x symbols)
+#   and optionally the transaction costs paid per day
+#   Share positions are the running sum of the trades, cash is the starting cash
+#   minus the running cost of the trades and of the transaction costs, and every
+#   position (long or short) is marked to market every day
+#   Returns the fund value, cash, holdings, long exposure and short exposure
+#   (negative) series as arrays
+
+def vectorized_values(initial_sum, trades, close_values, daily_costs=None):
+
+    positions = np.cumsum(trades, axis=0)
+    cash_flows = np.einsum('ij,ij->i', trades, close_values)
+    if daily_costs is not None:
+        cash_flows = cash_flows + daily_costs
+    cash = initial_sum - np.cumsum(cash_flows)
+
+    position_values = positions * close_values
+    long_exposure = np.where(position_values > 0, position_values, 0.0).sum(axis=1)
+    short_exposure = np.where(position_values < 0, position_values, 0.0).sum(axis=1)
+    holdings = long_exposure + short_exposure
+
+    return (cash + holdings, cash, holdings, long_exposure, short_exposure)
 
-        writer = csv.writer(open(values_file, 'wb'), delimiter=',')
-        for d in sorted(fund_daily_returns):
-            row_to_enter = [d.year, d.month, d.day, fund_daily_returns[d]]
-            writer.writerow(row_to_enter)
+
+# Columns of the vectorized simulator's output. Short exposure is negative, gross
+# exposure is long minus short and net exposure is long plus short. Costs are the
+# transaction costs paid so far
+VALUE_COLUMNS = ['value', 'cash', 'holdings', 'long_exposure', 'short_exposure', 'gross_exposure', 'net_exposure',
+                 'costs']
+
+
+# Function: simulate_order_books
+# Description:
+#   Takes the starting cash, a list of OrderBooks and optionally a cost model
+#   (see costs.py)
+#   Loads the close values (and the volume if the cost model needs it) for the
+#   union of their symbols and dates once, then simulates every book with the
+#   vectorized trade matrix against that panel
+#   Returns one DataFrame of VALUE_COLUMNS per book, each covering the trading
+#   days from the book's first to its last order
+#   Raises ValueError for an empty book, which has no days to value
+
+def simulate_order_books(initial_sum, order_books, cost_model=None):
+
+    if any(len(order_book) == 0 for order_book in order_books):
+        raise ValueError('Cannot simulate an empty order book: there are no order dates to value the fund on')
+
+    all_symbols = set()
+    for order_book in order_books:
+        all_symbols.update(order_book.symbols)
+
+    first_date = min(order_book.first_date() for order_book in order_books)
+    last_date = max(order_book.last_date() for order_book in order_books)
+
+    time_of_day = dt.timedelta(hours=16)
+    timestamps = du.getNYSEdays(first_date, last_date, time_of_day)
+    dates_index = pd.DatetimeIndex(timestamps)
+
+    keys = ['close']
+    if cost_model is not None and cost_model.needs_volume:
+        keys.append('volume')
+    symbol_data = pc.get_data(timestamps, sorted(all_symbols), keys)
+
+    fund_values = []
+    for order_book in order_books:
+        first = dates_index.searchsorted(order_book.first_date())
+        last = dates_index.searchsorted(order_book.last_date(), side='right')
+        close_values = symbol_data['close'][order_book.symbols].values[first:last]
+
+        book_timestamps = timestamps[first:last]
+        trades = order_book.trades(book_timestamps, order_book.symbols)
+
+        daily_costs = np.zeros(len(book_timestamps))
+        if cost_model is not None:
+            volume_values = None
+            if cost_model.needs_volume:
+                volume_values = symbol_data['volume'][order_book.symbols].values[first:last]
+            daily_costs = cost_model.costs(order_book.traded_shares(book_timestamps, order_book.symbols),
+                                           order_book.trade_counts(book_timestamps, order_book.symbols),
+                                           close_values, volume_values).sum(axis=1)
+
+        value, cash, holdings, long_exposure, short_exposure = vectorized_values(initial_sum, trades, close_values,
+                                                                                 daily_costs)
+
+        fund_values.append(pd.DataFrame({'value': value, 'cash': cash, 'holdings': holdings,
+                                         'long_exposure': long_exposure, 'short_exposure': short_exposure,
+                                         'gross_exposure': long_exposure - short_exposure,
+                                         'net_exposure': holdings, 'costs': np.cumsum(daily_costs)},
+                                        index=dates_index[first:last], columns=VALUE_COLUMNS))
+
+    return fund_values
+
+
+# Function: simulate_orders_vectorized
+# Description:
+#   Takes the starting cash, an OrderBook and optionally a cost model
+#   Builds the dates x symbols trade matrix from all the orders at once instead
+#   of executing them one by one
+#   Unlike the day by day loop, positions that were not traded on an order day
+#   are still re-marked, and short positions are valued too
+#   Returns a DataFrame of VALUE_COLUMNS per trading day
+
+def simulate_orders_vectorized(initial_sum, order_book, cost_model=None):
+
+    return simulate_order_books(initial_sum, [order_book], cost_model)[0]
+
+
+# Function: batch_main
+# Description:
+#   Takes the starting cash, a list of orders files (or one directory of them)
+#   the directory to write the values files to, optionally a cost model and the
+#   values format ('csv' or 'npy')
+#   Simulates all the books against one data load and writes
+#   values-<orders file name>.<values format> for each of them
+
+def batch_main(initial_sum, orders_files, values_dir, cost_model=None, values_format='csv'):
+
+    if len(orders_files) == 1 and os.path.isdir(orders_files[0]):
+        orders_dir = orders_files[0]
+        orders_files = sorted(os.path.join(orders_dir, name) for name in os.listdir(orders_dir)
+                              if name.lower().endswith('.csv'))
+
+    order_books = [read_order_book(orders_file) for orders_file in orders_files]
+    fund_values = simulate_order_books(initial_sum, order_books, cost_model)
+
+    if not os.path.isdir(values_dir):
+        os.makedirs(values_dir)
+
+    for book_idx in range(len(orders_files)):
+        book_name = os.path.splitext(os.path.basename(orders_files[book_idx]))[0]
+        values_file = os.path.join(values_dir, 'values-' + book_name + '.' + values_format)
+        values_io.write_values(values_file, list(fund_values[book_idx].index), fund_values[book_idx]['value'].values)
+
+
+# Function: order_chunks
+# Description:
+#   Takes the orders CSV file, which must be sorted by date, and the number of
+#   orders per chunk
+#   Reads the file a chunk at a time; a chunk is only cut where the date changes,
+#   so all the orders of a day are in the same chunk
+#   Raises ValueError if an order is dated before the one above it
+#   Yields the order arrays (dates, symbols, order types, shares) of every chunk
+
+def order_chunks(orders_file, chunk_size=100000):
+
+    chunk = ([], [], [], [])
+    last_date = None
+
+    reader = csv.reader(open(orders_file, 'rU'), delimiter=',')
+    for row in reader:
+        full_date = dt.datetime(int(row[0]), int(row[1]), int(row[2]), 16)
+
+        if last_date is not None and full_date < last_date:
+            raise ValueError('Orders are not sorted by date: %s after %s in %s' % (full_date, last_date, orders_file))
+
+        if len(chunk[0]) >= chunk_size and full_date != last_date:
+            yield chunk
+            chunk = ([], [], [], [])
+
+        chunk[0].append(full_date)
+        chunk[1].append(row[3])
+        chunk[2].append(str(row[4]))
+        chunk[3].append(int(row[5]))
+        last_date = full_date
+
+    if len(chunk[0]) > 0:
+        yield chunk
+
+
+# Function: scan_orders
+# Description:
+#   Takes the orders CSV file
+#   First pass over the file that keeps nothing but the symbols and date bounds
+#   Returns the sorted symbols, the first and the last order date
+
+def scan_orders(orders_file, chunk_size=100000):
+
+    all_symbols = set()
+    first_date = None
+    last_date = None
+
+    for order_dates, order_symbols, order_types, order_shares in order_chunks(orders_file, chunk_size):
+        if first_date is None:
+            first_date = order_dates[0]
+        last_date = order_dates[-1]
+        all_symbols.update(order_symbols)
+
+    return (sorted(all_symbols), first_date, last_date)
+
+
+# Function: simulate_orders_streaming
+# Description:
+#   Takes the starting cash and a date sorted orders CSV file
+#   For order files too big to hold in memory: after the first pass for the
+#   symbols and dates, the orders are applied a chunk at a time and only the
+#   share positions and cash are carried from one chunk to the next
+#   Values every day the same way as the vectorized simulator
+#   Returns the total fund value keyed by date
+
+def simulate_orders_streaming(initial_sum, orders_file, chunk_size=100000):
+
+    symbols_list, first_date, last_date = scan_orders(orders_file, chunk_size)
+
+    time_of_day = dt.timedelta(hours=16)
+    timestamps = du.getNYSEdays(first_date, last_date, time_of_day)
+    dates_index = pd.DatetimeIndex(timestamps)
+
+    close_values = pc.get_data(timestamps, symbols_list, ['close'])['close'][symbols_list].values
+
+    fund_daily_returns = {}
+    positions = np.zeros(len(symbols_list))
+    cash = float(initial_sum)
+    first = 0
+
+    for order_dates, order_symbols, order_types, order_shares in order_chunks(orders_file, chunk_size):
+        last = dates_index.searchsorted(order_dates[-1], side='right')
+        chunk_close = close_values[first:last]
+
+        order_book = order_book_from_arrays(order_dates, order_symbols, order_types, order_shares)
+        trades = order_book.trades(timestamps[first:last], symbols_list)
+        chunk_positions = positions + np.cumsum(trades, axis=0)
+        chunk_cash = cash - np.cumsum(np.einsum('ij,ij->i', trades, chunk_close))
+        chunk_values = chunk_cash + np.einsum('ij,ij->i', chunk_positions, chunk_close)
+
+        for idx in range(last - first):
+            fund_daily_returns[timestamps[first + idx]] = chunk_values[idx]
+
+        if last > first:
+            positions = chunk_positions[-1]
+            cash = chunk_cash[-1]
+        first = last
+
+    return fund_daily_returns
+
+
+# Function: simulate_orders_incremental
+# Description:
+#   Takes the starting cash and the orders mapped by date and by symbol
+#   Replays the close values one bar per day through an IncrementalPortfolio,
+#   passing only the symbols whose close changed since the day before
+#   Returns the total fund value keyed by date
+
+def simulate_orders_incremental(initial_sum, orders_dict_by_date, orders_dict_by_symbol):
+
+    dates_list = sorted(orders_dict_by_date)
+    symbols_list = sorted(orders_dict_by_symbol)
+
+    time_of_day = dt.timedelta(hours=16)
+    timestamps = du.getNYSEdays(dates_list[0], dates_list[-1], time_of_day)
+
+    close_values = pc.get_data(timestamps, symbols_list, ['close'])['close'][symbols_list].values
+
+    p = IncrementalPortfolio(initial_sum, 0)
+    fund_daily_returns = {}
+
+    changed = np.ones(len(symbols_list), dtype=bool)
+    for idx in range(len(timestamps)):
+        if idx > 0:
+            changed = close_values[idx] != close_values[idx - 1]
+        prices = dict((symbols_list[col], close_values[idx, col]) for col in np.nonzero(changed)[0])
+
+        d = timestamps[idx]
+        fund_daily_returns[d] = p.append_bar(prices, orders_dict_by_date.get(d, []))
+
+    return fund_daily_returns
+
+
+# Function: write_values
+# Description:
+#   Takes the values file and the total fund value keyed by date
+#   Writes one year, month, day, value row per date, or the binary values format
+#   if the file name ends in .npy (see Common/values_io.py)
+
+def write_values(values_file, fund_daily_returns):
+
+        dates = sorted(fund_daily_returns)
+        values_io.write_values(values_file, dates, [fund_daily_returns[d] for d in dates])
+
+
+def main():
+
+	# Optional costs=<spec> argument for the vectorized and batch modes, e.g.
+	# costs=fixed:9.95,bps:5,impact:0.1 (see costs.py)
+	cost_model = None
+	for arg in sys.argv[1:]:
+		if arg.lower().startswith('costs='):
+			cost_model = costs.parse_cost_model(arg[len('costs='):])
+			sys.argv.remove(arg)
+
+	# Optional format=npy argument for the batch mode's values files
+	values_format = 'csv'
+	for arg in sys.argv[1:]:
+		if arg.lower().startswith('format='):
+			values_format = arg[len('format='):].lower()
+			sys.argv.remove(arg)
+
+	# python marketsim.py batch <initial cash> <orders files or directory> <values directory>
+	# Single runs write the binary values format if the values file ends in .npy
+	if sys.argv[1].lower() == 'batch':
+		batch_main(int(sys.argv[2]), sys.argv[3:-1], sys.argv[-1], cost_model, values_format)
+		return
+
+	initial_sum = int(sys.argv[1])
+	orders_file = sys.argv[2]
+	values_file = sys.argv[3]
+	mode = sys.argv[4].lower() if len(sys.argv) > 4 else 'loop'
+
+	# Only the vectorized simulator charges transaction costs
+	if cost_model is not None and mode != 'vectorized':
+		raise ValueError('costs= needs the vectorized or batch mode, not the %s mode' % mode)
+
+	if mode == 'vectorized':
+		fund_values = simulate_orders_vectorized(initial_sum, read_order_book(orders_file), cost_model)
+		fund_daily_returns = dict(zip(fund_values.index, fund_values['value']))
+	elif mode == 'incremental':
+		orders_dict_by_date, orders_dict_by_symbol = read_orders(orders_file)
+		fund_daily_returns = simulate_orders_incremental(initial_sum, orders_dict_by_date, orders_dict_by_symbol)
+	elif mode == 'streaming':
+		fund_daily_returns = simulate_orders_streaming(initial_sum, orders_file)
+	else:
+		orders_dict_by_date, orders_dict_by_symbol = read_orders(orders_file)
+		fund_daily_returns = simulate_orders(initial_sum, orders_dict_by_date, orders_dict_by_symbol)
+
+	write_values(values_file, fund_daily_returns)
 
 
 